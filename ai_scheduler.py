@@ -0,0 +1,199 @@
+import asyncio
+import math
+import time
+from collections import deque
+from config import settings
+
+
+class RateLimited(Exception):
+    """Запрос к ИИ не допущен: превышен лимит пользователя, очередь полна или ожидание истекло."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Забирает токен; возвращает 0 или через сколько секунд токен появится."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Возвращает токен запроса, который так и не был обслужен."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        """Бакет успел наполниться — он ничем не отличается от нового."""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Slot:
+    """Занятое место в планировщике; освобождается ровно один раз."""
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release()
+
+    def __del__(self):
+        # Страховка на случай, если поток ответа так и не был запущен
+        self.release()
+
+
+class AIScheduler:
+    """
+    Планировщик запросов к ИИ в пределах воркера.
+
+    Глобальный лимит одновременных запросов, token bucket на пользователя и
+    очередь с обходом пользователей по кругу: тяжелый пользователь ждет
+    своей очереди наравне с остальными, а не занимает все места. Если
+    очередь переполнена или ожидание затянулось, запрос сразу отклоняется.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float, user_rate: float, user_burst: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+
+        self.active = 0
+        self._buckets = {}
+        # Полные бакеты удаляем не чаще, чем бакет успевает наполниться с нуля
+        self._sweep_interval = user_burst / user_rate if user_rate > 0 else 60.0
+        self._last_sweep = time.monotonic()
+        # Очереди ожидающих по пользователям и круговой порядок пользователей
+        self._waiters = {}
+        self._ring = deque()
+        self._queued = 0
+
+        self._waits = deque(maxlen=1000)
+        self._admitted = 0
+        self._rejected = {"rate_limited": 0, "queue_full": 0, "timeout": 0}
+
+    async def acquire(self, user_id) -> _Slot:
+        self._sweep_buckets()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _TokenBucket(self.user_rate, self.user_burst)
+
+        # Переполненную очередь проверяем до токена: отказ не должен тратить лимит пользователя
+        must_wait = self.active >= self.max_concurrent or self._queued
+        if must_wait and self._queued >= self.max_queue:
+            self._rejected["queue_full"] += 1
+            raise RateLimited("queue_full", self.max_wait)
+
+        retry_after = bucket.take()
+        if retry_after:
+            self._rejected["rate_limited"] += 1
+            raise RateLimited("rate_limited", retry_after)
+
+        started = time.monotonic()
+        if not must_wait:
+            self.active += 1
+            return self._admit(started)
+
+        future = asyncio.get_running_loop().create_future()
+        if user_id not in self._waiters:
+            self._waiters[user_id] = deque()
+            self._ring.append(user_id)
+        self._waiters[user_id].append(future)
+        self._queued += 1
+
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._discard(user_id, future)
+            bucket.refund()
+            self._rejected["timeout"] += 1
+            raise RateLimited("timeout", self.max_wait)
+        except BaseException:
+            # Клиент ушел, пока ждал: возвращаем место, если его уже успели выдать
+            self._discard(user_id, future)
+            if future.done() and not future.cancelled():
+                self._release()
+            bucket.refund()
+            raise
+        return self._admit(started)
+
+    def _sweep_buckets(self):
+        """Убирает бакеты пользователей, которые давно не спрашивали: в памяти только недавно активные."""
+        now = time.monotonic()
+        if now - self._last_sweep < self._sweep_interval:
+            return
+        self._last_sweep = now
+        for user_id in [user_id for user_id, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[user_id]
+
+    def _admit(self, started: float) -> _Slot:
+        self._admitted += 1
+        self._waits.append(time.monotonic() - started)
+        return _Slot(self)
+
+    def _discard(self, user_id, future):
+        queue = self._waiters.get(user_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[user_id]
+                self._ring.remove(user_id)
+
+    def _release(self):
+        self.active -= 1
+        # Отдаем место следующему пользователю по кругу
+        while self._ring and self.active < self.max_concurrent:
+            user_id = self._ring.popleft()
+            queue = self._waiters[user_id]
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._ring.append(user_id)
+            else:
+                del self._waiters[user_id]
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 4) if waits else 0.0
+
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self._queued,
+            "queued_users": len(self._ring),
+            "tracked_users": len(self._buckets),
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+            "wait_seconds": {"p50": percentile(0.5), "p95": percentile(0.95), "max": round(waits[-1], 4) if waits else 0.0},
+        }
+
+
+scheduler = AIScheduler(
+    max_concurrent=settings.AI_SCHEDULER_MAX_CONCURRENT,
+    max_queue=settings.AI_SCHEDULER_MAX_QUEUE,
+    max_wait=settings.AI_SCHEDULER_MAX_WAIT,
+    user_rate=settings.AI_USER_REQUESTS_PER_MINUTE / 60,
+    user_burst=settings.AI_USER_BURST,
+)
@@ -1,57 +1,234 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+import datetime
+import time
+from config import settings
+from cache import TTLCache
+import models, metrics
 
-load_dotenv()
+_genai = None
 
-# Настройка Gemini
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
+def sdk():
+    """
+    Модуль google.generativeai, импортированный и настроенный при первом обращении.
 
-async def analyze_poem_with_chat(poem_content: str, user_query: str, chat_history: list = None):
+    Импорт SDK занимает около секунды, поэтому он не входит в запуск воркера:
+    платит только первый запрос к ИИ.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        # Ключ читается из окружения или .env через настройки
+        genai.configure(api_key=settings.GOOGLE_API_KEY or None)
+        _genai = genai
+    return _genai
+
+AI_ERROR_MESSAGE = "К сожалению, произошла ошибка при обращении к нейросети. Попробуйте еще раз позже."
+
+# Глобальный лимит одновременных обращений к Gemini в пределах воркера
+_upstream_slots = asyncio.Semaphore(settings.AI_MAX_CONCURRENT_STREAMS)
+
+# Локальная запись о серверном кэше контекста истекает раньше него на этот запас (сек),
+# чтобы запрос не ушел в уже удаленный кэш; при коротком TTL — не больше его десятой части
+CONTEXT_CACHE_EXPIRY_MARGIN = 60
+# Фоновые удаления серверных кэшей (ссылки держим, чтобы задачи не собрал GC)
+_pending_deletes = set()
+
+def _release_model(key, entry):
+    """Удаляет серверный кэш контекста вытесненной модели, чтобы он не оплачивался до конца TTL."""
+    model, cached_content, server_expires_at = entry
+    if cached_content is None or server_expires_at <= time.monotonic():
+        return
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(_delete_cached_content, cached_content))
+    _pending_deletes.add(task)
+    task.add_done_callback(_pending_deletes.discard)
+
+# Готовые GenerativeModel по (poem_id, хэш текста): системный промпт собирается один раз на стих.
+# Значение — (модель, CachedContent или None, когда истекает серверный кэш по time.monotonic())
+_model_cache = TTLCache(
+    maxsize=settings.AI_MODEL_CACHE_SIZE, ttl=settings.AI_MODEL_CACHE_TTL, on_evict=_release_model
+)
+# Модели, которые создаются прямо сейчас: конкурентные промахи ждут одну загрузку
+_model_loading = {}
+
+async def analyze_poem_with_chat(poem_content: str, user_query: str, chat_history: list = None, summary: str = None, poem_id: int = None):
     """Возвращает полный ответ от ИИ одним блоком."""
-    try:
-        model, history_for_gemini = _prepare_model_and_history(poem_content, chat_history)
-        chat = model.start_chat(history=history_for_gemini)
-        response = chat.send_message(user_query)
-        return response.text
-    except Exception as e:
-        print(f"AI Service Error: {e}")
-        return "К сожалению, произошла ошибка при обращении к нейросети. Попробуйте еще раз позже."
+    async with _upstream_slots:
+        try:
+            model, history_for_gemini = await _prepare_model_and_history(poem_content, chat_history, summary, poem_id)
+            chat = model.start_chat(history=history_for_gemini)
+            response = await chat.send_message_async(user_query)
+            return response.text
+        except Exception as e:
+            print(f"AI Service Error: {e}")
+            return AI_ERROR_MESSAGE
 
-def analyze_poem_with_chat_stream(poem_content: str, user_query: str, chat_history: list = None):
-    """Возвращает генератор для потоковой передачи ответа от ИИ."""
-    try:
-        model, history_for_gemini = _prepare_model_and_history(poem_content, chat_history)
-        chat = model.start_chat(history=history_for_gemini)
-        response_stream = chat.send_message(user_query, stream=True)
-        
-        for chunk in response_stream:
-            # Отдаем только текстовую часть каждого блока
-            if chunk.text:
-                yield chunk.text
-    except Exception as e:
-        print(f"AI Service Stream Error: {e}")
-        yield "К сожалению, произошла ошибка при обращении к нейросети. Попробуйте еще раз позже."
+async def analyze_poem_with_chat_stream(poem_content: str, user_query: str, chat_history: list = None, summary: str = None, poem_id: int = None, result: dict = None):
+    """
+    Асинхронный генератор для потоковой передачи ответа от ИИ.
 
-def _prepare_model_and_history(poem_content: str, chat_history: list = None):
-    """Вспомогательная функция для подготовки модели и истории чата."""
-    system_instruction = (
+    Работает целиком в event loop, без потоков из threadpool. Следующий блок
+    читается из Gemini только когда потребитель забрал предыдущий, поэтому
+    медленный клиент естественным образом притормаживает свой поток.
+
+    При ошибке посреди ответа последним блоком идет AI_ERROR_MESSAGE после
+    уже отданного текста. Если передан result, в result["outcome"] по
+    окончании записывается "complete" или "error".
+    """
+    async with _upstream_slots:
+        started = time.perf_counter()
+        first_chunk_at = None
+        chunks = 0
+        outcome = "error"
+        try:
+            model, history_for_gemini = await _prepare_model_and_history(poem_content, chat_history, summary, poem_id)
+            chat = model.start_chat(history=history_for_gemini)
+            response_stream = await chat.send_message_async(user_query, stream=True)
+
+            async for chunk in response_stream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                    metrics.AI_FIRST_CHUNK_SECONDS.observe(first_chunk_at - started)
+                chunks += 1
+                # Отдаем только текстовую часть каждого блока
+                if chunk.text:
+                    yield chunk.text
+            outcome = "complete"
+        except Exception as e:
+            print(f"AI Service Stream Error: {e}")
+            yield AI_ERROR_MESSAGE
+        finally:
+            if result is not None:
+                result["outcome"] = outcome
+            _observe_stream(started, first_chunk_at, chunks, outcome)
+
+async def summarize_history(previous_summary: str, turns: list):
+    """
+    Дописывает в краткое содержание беседы новые реплики.
+
+    Получает только еще не учтенные реплики, так что стоимость вызова не растет
+    с длиной сессии. При ошибке возвращает None — summary останется прежним.
+    """
+    transcript = "\n".join(
+        f"{'Пользователь' if turn.role == 'user' else 'Ассистент'}: {turn.content}" for turn in turns
+    )
+    prompt = (
+        "Обнови краткое содержание беседы о стихотворении, добавив в него новые реплики. "
+        "Сохрани вопросы пользователя, выводы и договоренности, опусти повторы. "
+        "Ответь только обновленным содержанием, не длиннее 200 слов.\n\n"
+        f"Текущее содержание:\n{previous_summary or '(пусто)'}\n\n"
+        f"Новые реплики:\n{transcript}"
+    )
+    async with _upstream_slots:
+        try:
+            model = sdk().GenerativeModel(settings.AI_MODEL_NAME)
+            response = await model.generate_content_async(prompt)
+            return response.text.strip()
+        except Exception as e:
+            print(f"AI Summary Error: {e}")
+            return None
+
+def _observe_stream(started: float, first_chunk_at: float, chunks: int, outcome: str):
+    """Длительность стрима и темп блоков после первого (без времени ожидания первого блока)."""
+    finished = time.perf_counter()
+    metrics.AI_STREAM_SECONDS.observe(finished - started)
+    metrics.AI_STREAMS.inc(outcome)
+    metrics.record("ai", finished - started)
+    if first_chunk_at is not None and chunks > 1 and finished > first_chunk_at:
+        metrics.AI_CHUNKS_PER_SECOND.observe((chunks - 1) / (finished - first_chunk_at))
+
+def invalidate_poem(poem_id: int):
+    """Выбрасывает из кэша модели стихотворения (после редактирования или удаления) вместе с серверным кэшем."""
+    for key in _model_cache.keys():
+        if key[0] == poem_id:
+            _release_model(key, _model_cache.pop(key))
+
+def _build_system_instruction(poem_content: str) -> str:
+    return (
         f"Ты — эрудированный и дружелюбный литературный критик. Твоя задача — помочь пользователю глубже понять произведение. "
         f"Мы обсуждаем стихотворение:\n\n---\n{poem_content}\n---\n\n"
         "Всегда отвечай по существу, основываясь на тексте произведения и контексте диалога. Будь вежлив и поддерживай беседу."
     )
 
-    model = genai.GenerativeModel(
-        'gemini-3-flash-preview', # Возвращаем flash, т.к. он быстрее для стриминга
+def _create_cached_model(system_instruction: str):
+    """
+    Загружает системный промпт в серверный кэш контекста Gemini (блокирующий вызов).
+
+    Кэш создается один раз на стихотворение и переиспользуется всеми сессиями.
+    Возвращает (модель, CachedContent). Если бэкенд кэш не поддерживает
+    (например, промпт короче минимального размера кэша), возвращает None,
+    и используется обычная модель.
+    """
+    try:
+        cached_content = sdk().caching.CachedContent.create(
+            model=settings.AI_MODEL_NAME,
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=settings.AI_MODEL_CACHE_TTL)
+        )
+    except Exception as e:
+        print(f"AI Context Cache Error: {e}")
+        return None
+    try:
+        return sdk().GenerativeModel.from_cached_content(cached_content), cached_content
+    except Exception as e:
+        print(f"AI Context Cache Error: {e}")
+        _delete_cached_content(cached_content)
+        return None
+
+def _delete_cached_content(cached_content):
+    """Удаляет серверный кэш контекста (блокирующий вызов)."""
+    try:
+        cached_content.delete()
+    except Exception as e:
+        print(f"AI Context Cache Delete Error: {e}")
+
+async def _load_poem_model(key, poem_content: str):
+    system_instruction = _build_system_instruction(poem_content)
+    created_at = time.monotonic()
+    cached = None
+    if settings.AI_CONTEXT_CACHE:
+        cached = await asyncio.to_thread(_create_cached_model, system_instruction)
+    if cached is not None:
+        model, cached_content = cached
+        margin = min(CONTEXT_CACHE_EXPIRY_MARGIN, settings.AI_MODEL_CACHE_TTL / 10)
+        ttl = settings.AI_MODEL_CACHE_TTL - margin
+        _model_cache.set(key, (model, cached_content, created_at + settings.AI_MODEL_CACHE_TTL), ttl=ttl)
+        return model
+
+    model = sdk().GenerativeModel(
+        settings.AI_MODEL_NAME, # flash, т.к. он быстрее для стриминга
         system_instruction=system_instruction
     )
+    _model_cache.set(key, (model, None, 0))
+    return model
+
+async def _get_poem_model(poem_content: str, poem_id: int = None):
+    """Модель с системным промптом стихотворения из LRU-кэша; одна загрузка на стих при конкурентных промахах."""
+    key = (poem_id, models.content_hash(poem_content))
+    entry = _model_cache.get(key)
+    if entry is not None:
+        return entry[0]
+
+    loading = _model_loading.get(key)
+    if loading is None:
+        loading = asyncio.ensure_future(_load_poem_model(key, poem_content))
+        _model_loading[key] = loading
+        loading.add_done_callback(lambda _: _model_loading.pop(key, None))
+    # Отмена одного запроса не должна обрывать загрузку, которую ждут остальные
+    return await asyncio.shield(loading)
+
+async def _prepare_model_and_history(poem_content: str, chat_history: list = None, summary: str = None, poem_id: int = None):
+    """Вспомогательная функция для подготовки модели и истории чата."""
+    model = await _get_poem_model(poem_content, poem_id)
     
     history_for_gemini = []
+    if summary:
+        # Свернутая часть беседы идет отдельной парой реплик, а не в system_instruction,
+        # чтобы системный промпт зависел только от стихотворения
+        history_for_gemini.append({"role": "user", "parts": [f"Краткое содержание нашей предыдущей беседы:\n{summary}"]})
+        history_for_gemini.append({"role": "model", "parts": ["Хорошо, продолжим с учетом этого."]})
     if chat_history:
         for msg in chat_history:
             role = "user" if msg.role == "user" else "model"
             history_for_gemini.append({"role": role, "parts": [msg.content]})
             
     return model, history_for_gemini
-                
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from config import settings
+from database import session_scope
+from chat_history import compact_session
+from chat_writer import writer
+import models
+
+# Стримы, которые генерируются в этом воркере: stream_id -> ChunkBroadcast
+_live = {}
+
+
+class ChunkBroadcast:
+    """Буфер блоков одного ответа, который одновременно читают несколько клиентов."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk: str = None):
+        """Добавляет блок; None означает конец ответа."""
+        async with self._changed:
+            if chunk is None:
+                self.done = True
+            else:
+                self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.chunks) > position)
+                new_chunks = self.chunks[position:]
+                finished = self.done
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if finished and position >= len(self.chunks):
+                return
+
+
+def format_sse(data: str, event_id=None, event: str = None) -> str:
+    """Одно событие text/event-stream; многострочный текст разбивается на строки data:."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in data.split("\n"):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def _pump(stream_id: str, session_id: str, answer_stream, broadcast: ChunkBroadcast, on_finish):
+    """
+    Дочитывает ответ модели до конца независимо от клиента.
+
+    Частичный ответ сохраняется пачками (по времени или объему), поэтому
+    обрыв соединения не теряет уже оплаченную генерацию.
+    """
+    status = "failed"
+    pending_chars = 0
+    last_checkpoint = time.monotonic()
+    try:
+        async for chunk in answer_stream:
+            await broadcast.publish(chunk)
+            pending_chars += len(chunk)
+            if (pending_chars >= settings.AI_STREAM_CHECKPOINT_CHARS
+                    or time.monotonic() - last_checkpoint >= settings.AI_STREAM_CHECKPOINT_INTERVAL):
+                writer.update(stream_id, "".join(broadcast.chunks))
+                pending_chars = 0
+                last_checkpoint = time.monotonic()
+        status = "complete"
+    except Exception as e:
+        print(f"AI Stream Error: {e}")
+    finally:
+        on_finish()
+        writer.update(stream_id, "".join(broadcast.chunks), status)
+        try:
+            # Из памяти стрим убираем только после записи: переподключение прочитает ответ из БД
+            await writer.sync(session_id)
+        finally:
+            _live.pop(stream_id, None)
+            await broadcast.publish(None)
+    await compact_session(session_id)
+
+
+def start_stream(stream_id: str, session_id: str, answer_stream, on_finish=lambda: None):
+    """Запускает генерацию ответа фоновой задачей; on_finish вызывается, когда модель закончила."""
+    broadcast = ChunkBroadcast()
+    broadcast.task = asyncio.create_task(
+        _pump(stream_id, session_id, answer_stream, broadcast, on_finish)
+    )
+    _live[stream_id] = broadcast
+
+
+async def close():
+    """
+    Обрывает стримы, которые еще идут, при остановке воркера.
+
+    Оборванный стрим сам записывает накопленный текст со статусом failed,
+    поэтому вызывать до writer.close(): иначе ответ потеряется, а стрим в БД
+    так и останется "streaming".
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [
+        broadcast.task for broadcast in list(_live.values())
+        if broadcast.task is not None and broadcast.task.get_loop() is loop
+    ]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def sse_events(stream_id: str, offset: int = 0):
+    """
+    События ответа начиная с позиции offset (в символах).
+
+    id каждого события — позиция конца отданного текста, так что клиент
+    переподключается с Last-Event-ID и получает только недостающую часть:
+    из памяти, если стрим идет в этом воркере, иначе из сохраненного ответа.
+    """
+    yield format_sse(stream_id, event="stream")
+
+    broadcast = _live.get(stream_id)
+    if broadcast is not None:
+        position = 0
+        async for chunk in broadcast.subscribe():
+            end = position + len(chunk)
+            if end > offset:
+                yield format_sse(chunk[max(0, offset - position):], event_id=end)
+            position = end
+        yield format_sse("", event="done")
+        return
+
+    stale_after = timedelta(seconds=settings.AI_STREAM_STALE_AFTER)
+    while True:
+        async with session_scope() as db:
+            row = (await db.execute(
+                select(models.ChatMessage.content, models.ChatStream.status, models.ChatStream.updated_at)
+                .join(models.ChatStream, models.ChatStream.message_id == models.ChatMessage.id)
+                .where(models.ChatStream.id == stream_id)
+            )).first()
+        if row is None:
+            break
+        content = row.content or ""
+        if len(content) > offset:
+            yield format_sse(content[offset:], event_id=len(content))
+            offset = len(content)
+        # Стрим идет в другом воркере: ждем следующую контрольную точку
+        if row.status != "streaming" or datetime.utcnow() - row.updated_at > stale_after:
+            break
+        await asyncio.sleep(settings.AI_STREAM_CHECKPOINT_INTERVAL)
+    yield format_sse("", event="done")
@@ -0,0 +1,210 @@
+"""
+Стандартные разборы стихов (краткое содержание, темы, размер, образы), сгенерированные заранее.
+
+Почти каждая сессия начинается с одних и тех же вопросов, поэтому ответы на
+них генерируются пакетно, вне запросов пользователей, и хранятся в
+poem_analyses с хэшем текста стиха. Устаревшим считается разбор, у которого
+хэш не совпадает с текущим текстом: следующий прогон пересчитывает только
+такие разборы (и отсутствующие), а старые версии удаляет.
+
+Прогон по всему каталогу:
+    python analyses.py [--poem ID ...] [--concurrency N]
+
+После добавления или правки стиха в админке прогон по нему запускается
+фоном в воркере (ANALYSIS_ON_SAVE).
+"""
+import asyncio
+from sqlalchemy import select, delete
+from config import settings
+from database import session_scope
+from answer_cache import normalize_question
+import ai_service
+import models
+
+# Вид разбора -> (подпись кнопки, вопрос, на который он отвечает)
+KINDS = {
+    "summary": ("Краткое содержание", "О чем это стихотворение? Кратко перескажи его содержание."),
+    "themes": ("Темы и мотивы", "Какие основные темы и мотивы этого стихотворения?"),
+    "meter": ("Размер и рифма", "Каким размером написано стихотворение и какая в нем рифмовка?"),
+    "imagery": ("Образы", "Какие образы и художественные средства в этом стихотворении главные?"),
+}
+_kind_by_question = {normalize_question(question): kind for kind, (label, question) in KINDS.items()}
+# Сколько стихов читаем из БД за раз при поиске устаревших разборов
+SCAN_BATCH = 200
+
+# Фоновые прогоны по отдельным стихам: poem_id -> задача
+_running = {}
+_rerun = set()
+_stats = {"generated": 0, "failed": 0, "retries": 0}
+
+
+async def _stale_jobs(queue: asyncio.Queue, poem_ids: list = None):
+    """Кладет в очередь (poem_id, хэш, текст, вид) для отсутствующих и устаревших разборов."""
+    last_id = 0
+    while True:
+        async with session_scope() as db:
+            stmt = select(models.Poem.id, models.Poem.content).where(models.Poem.id > last_id)
+            if poem_ids is not None:
+                stmt = stmt.where(models.Poem.id.in_(poem_ids))
+            poems = (await db.execute(stmt.order_by(models.Poem.id).limit(SCAN_BATCH))).all()
+            if not poems:
+                return
+            hashes = {poem.id: models.content_hash(poem.content) for poem in poems}
+            rows = (await db.execute(
+                select(models.PoemAnalysis.poem_id, models.PoemAnalysis.kind, models.PoemAnalysis.content_hash)
+                .where(models.PoemAnalysis.poem_id.in_(list(hashes)))
+            )).all()
+        existing = {(row.poem_id, row.kind) for row in rows if row.content_hash == hashes[row.poem_id]}
+        for poem in poems:
+            if not (poem.content or "").strip():
+                continue
+            for kind in KINDS:
+                if (poem.id, kind) not in existing:
+                    # Очередь ограничена, поэтому сканирование не убегает вперед генерации
+                    await queue.put((poem.id, hashes[poem.id], poem.content, kind))
+        last_id = poems[-1].id
+
+
+async def _generate(poem_id: int, content: str, kind: str):
+    """Ответ модели на стандартный вопрос с повторами; None, если все попытки неудачны."""
+    question = KINDS[kind][1]
+    for attempt in range(settings.ANALYSIS_RETRIES + 1):
+        if attempt:
+            _stats["retries"] += 1
+            await asyncio.sleep(settings.ANALYSIS_RETRY_DELAY * 2 ** (attempt - 1))
+        answer = await ai_service.analyze_poem_with_chat(content, question, poem_id=poem_id)
+        if answer and answer != ai_service.AI_ERROR_MESSAGE:
+            return answer
+    return None
+
+
+async def _store(poem_id: int, digest: str, kind: str, answer: str) -> bool:
+    """Сохраняет разбор, если текст стиха не изменился за время генерации; старые версии удаляет."""
+    async with session_scope() as db:
+        content = await db.scalar(select(models.Poem.content).where(models.Poem.id == poem_id))
+        if content is None or models.content_hash(content) != digest:
+            return False
+        await db.execute(delete(models.PoemAnalysis).where(
+            models.PoemAnalysis.poem_id == poem_id,
+            models.PoemAnalysis.kind == kind
+        ))
+        db.add(models.PoemAnalysis(poem_id=poem_id, kind=kind, content_hash=digest, content=answer))
+        await db.commit()
+    return True
+
+
+async def _worker(queue: asyncio.Queue, result: dict):
+    while True:
+        job = await queue.get()
+        try:
+            if job is None:
+                return
+            poem_id, digest, content, kind = job
+            answer = await _generate(poem_id, content, kind)
+            if answer is None:
+                result["failed"] += 1
+                _stats["failed"] += 1
+            elif await _store(poem_id, digest, kind, answer):
+                result["generated"] += 1
+                _stats["generated"] += 1
+            else:
+                result["outdated"] += 1
+        except Exception as e:
+            print(f"Poem analysis failed for poem {job[0]} ({job[3]}): {e}")
+            result["failed"] += 1
+            _stats["failed"] += 1
+        finally:
+            queue.task_done()
+
+
+async def run(poem_ids: list = None, concurrency: int = None) -> dict:
+    """
+    Генерирует отсутствующие и устаревшие разборы пулом из concurrency воркеров.
+
+    Возвращает счетчики: generated, failed и outdated (стих изменился во время генерации).
+    """
+    concurrency = max(1, concurrency or settings.ANALYSIS_CONCURRENCY)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    result = {"generated": 0, "failed": 0, "outdated": 0}
+    workers = [asyncio.create_task(_worker(queue, result)) for _ in range(concurrency)]
+    try:
+        await _stale_jobs(queue, poem_ids)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return result
+
+
+async def _run_for_poem(poem_id: int):
+    try:
+        while True:
+            _rerun.discard(poem_id)
+            await run([poem_id])
+            # Стих снова изменили, пока шел прогон, — пересчитываем под новый текст
+            if poem_id not in _rerun:
+                return
+    except Exception as e:
+        print(f"Poem analysis run failed for poem {poem_id}: {e}")
+    finally:
+        _running.pop(poem_id, None)
+
+
+def schedule(poem_id: int):
+    """Запускает фоновый прогон по стиху (после добавления или правки в админке)."""
+    if not settings.ANALYSIS_ON_SAVE:
+        return
+    if poem_id in _running:
+        _rerun.add(poem_id)
+        return
+    _running[poem_id] = asyncio.create_task(_run_for_poem(poem_id))
+
+
+async def close():
+    """Останавливает фоновые прогоны; недоделанное подхватит следующий запуск `python analyses.py`."""
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def suggestions(db, poem) -> list:
+    """Готовые разборы текущей версии стиха: [{kind, label, question}] в порядке KINDS."""
+    kinds = set((await db.scalars(select(models.PoemAnalysis.kind).where(
+        models.PoemAnalysis.poem_id == poem.id,
+        models.PoemAnalysis.content_hash == poem.content_hash
+    ))).all())
+    return [
+        {"kind": kind, "label": label, "question": question}
+        for kind, (label, question) in KINDS.items() if kind in kinds
+    ]
+
+
+async def prepared_answer(db, poem_id: int, poem_content: str, question: str):
+    """Заготовленный ответ, если вопрос — один из стандартных и разбор актуален; иначе None."""
+    kind = _kind_by_question.get(normalize_question(question))
+    if kind is None:
+        return None
+    return await db.scalar(select(models.PoemAnalysis.content).where(
+        models.PoemAnalysis.poem_id == poem_id,
+        models.PoemAnalysis.kind == kind,
+        models.PoemAnalysis.content_hash == models.content_hash(poem_content)
+    ))
+
+
+def stats() -> dict:
+    return {**_stats, "running": len(_running)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Генерация стандартных разборов стихов")
+    parser.add_argument("--poem", type=int, action="append", help="только эти стихи (можно несколько раз)")
+    parser.add_argument("--concurrency", type=int, default=settings.ANALYSIS_CONCURRENCY)
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args.poem, args.concurrency))
+    print(f"Generated {summary['generated']}, failed {summary['failed']}, outdated {summary['outdated']}")
@@ -0,0 +1,110 @@
+import asyncio
+import re
+from cache import TTLCache
+from config import settings
+from ai_streams import ChunkBroadcast
+import ai_service
+import models
+
+# Готовые ответы на первый вопрос сессии (без истории) по (poem_id, хэш текста, вопрос)
+_answers = TTLCache(maxsize=settings.AI_ANSWER_CACHE_SIZE, ttl=settings.AI_ANSWER_CACHE_TTL)
+# Запросы к Gemini, которые выполняются прямо сейчас, по тому же ключу
+_in_flight = {}
+_coalesced = 0
+
+
+def normalize_question(question: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, пробелы, финальная пунктуация."""
+    text = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return text.rstrip(" ?!.…")
+
+
+async def _run_flight(key, flight: ChunkBroadcast, poem_content: str, question: str, poem_id: int):
+    """
+    Читает ответ Gemini до конца, раздает блоки подписчикам и кладет результат в кэш.
+
+    Работает отдельной задачей, поэтому отключение первого клиента не обрывает
+    поток для остальных, а оплаченный ответ все равно попадает в кэш.
+    Оборванный ответ (часть текста и сообщение об ошибке) не кэшируется.
+    """
+    result = {}
+    try:
+        async for chunk in ai_service.analyze_poem_with_chat_stream(
+            poem_content, question, poem_id=poem_id, result=result
+        ):
+            await flight.publish(chunk)
+        answer = "".join(flight.chunks)
+        if answer and result.get("outcome") == "complete":
+            _answers.set(key, answer)
+    finally:
+        _in_flight.pop(key, None)
+        await flight.publish(None)
+
+
+def _key(poem_id: int, poem_content: str, question: str):
+    return poem_id, models.content_hash(poem_content), normalize_question(question)
+
+
+def shared_stream(poem_id: int, poem_content: str, question: str):
+    """
+    Поток ответа на первый вопрос сессии без нового обращения к Gemini:
+    из кэша или из уже идущего запроса. None, если такого ответа нет.
+    """
+    global _coalesced
+    key = _key(poem_id, poem_content, question)
+
+    answer = _answers.get(key)
+    if answer is not None:
+        return replay(answer)
+
+    flight = _in_flight.get(key)
+    if flight is not None:
+        _coalesced += 1
+        return flight.subscribe()
+    return None
+
+
+def first_turn_stream(poem_id: int, poem_content: str, question: str):
+    """
+    Поток ответа на первый вопрос сессии новым запросом к Gemini.
+
+    Вызывается, когда shared_stream ничего не нашел и место в планировщике
+    уже получено; за время ожидания ответ мог появиться — тогда берем его.
+    """
+    global _coalesced
+    key = _key(poem_id, poem_content, question)
+
+    answer = _answers.peek(key)
+    if answer is not None:
+        return replay(answer)
+
+    flight = _in_flight.get(key)
+    if flight is not None:
+        _coalesced += 1
+    else:
+        flight = ChunkBroadcast()
+        _in_flight[key] = flight
+        flight.task = asyncio.create_task(_run_flight(key, flight, poem_content, question, poem_id))
+    return flight.subscribe()
+
+
+async def replay(answer: str):
+    """Готовый ответ в виде потока из одного блока."""
+    yield answer
+
+
+def invalidate_poem(poem_id: int):
+    """Удаляет закэшированные ответы по стихотворению."""
+    for key in _answers.keys():
+        if key[0] == poem_id:
+            _answers.pop(key)
+
+
+def stats() -> dict:
+    return {
+        "size": len(_answers),
+        "hits": _answers.hits,
+        "misses": _answers.misses,
+        "coalesced": _coalesced,
+        "in_flight": len(_in_flight),
+    }
@@ -0,0 +1,99 @@
+"""
+Детерминированная замена Gemini для нагрузочных тестов.
+
+install() подменяет google.generativeai.GenerativeModel, так что ai_service
+работает как обычно (семафор, кэш моделей, окно истории), но вместо сети
+отвечает фейковая модель: первый блок приходит через ttft секунд, дальше
+блоки по tokens_per_chunk «токенов» со скоростью tokens_per_sec. Текст ответа
+зависит только от вопроса, поэтому прогоны воспроизводимы.
+"""
+import asyncio
+import hashlib
+import random
+
+import google.generativeai as genai
+
+WORDS = (
+    "строфа рифма образ метафора ритм размер ямб хорей пауза интонация "
+    "лирический герой мотив контраст символ эпитет аллитерация финал тема"
+).split()
+
+
+class Profile:
+    def __init__(self, ttft: float = 0.5, tokens_per_sec: float = 60.0, answer_tokens: int = 120, tokens_per_chunk: int = 8):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.tokens_per_chunk = tokens_per_chunk
+
+
+profile = Profile()
+
+
+def _answer_tokens(prompt: str) -> list:
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    return [rng.choice(WORDS) for _ in range(profile.answer_tokens)]
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _StreamResponse:
+    def __init__(self, prompt: str):
+        self._tokens = _answer_tokens(prompt)
+        self.text = " ".join(self._tokens)
+
+    async def __aiter__(self):
+        await asyncio.sleep(profile.ttft)
+        step = profile.tokens_per_chunk
+        for i in range(0, len(self._tokens), step):
+            if i:
+                await asyncio.sleep(step / profile.tokens_per_sec)
+            yield _Chunk(" ".join(self._tokens[i:i + step]) + " ")
+
+
+class _Response:
+    def __init__(self, prompt: str):
+        self.text = " ".join(_answer_tokens(prompt))
+
+
+class _Chat:
+    def __init__(self, history):
+        self.history = history or []
+
+    async def send_message_async(self, content, stream: bool = False):
+        if stream:
+            return _StreamResponse(str(content))
+        await asyncio.sleep(profile.ttft + profile.answer_tokens / profile.tokens_per_sec)
+        return _Response(str(content))
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name: str = None, system_instruction: str = None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls()
+
+    def start_chat(self, history=None):
+        return _Chat(history)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        # Сворачивание истории — короткий не потоковый ответ
+        await asyncio.sleep(profile.ttft)
+        return _Response(str(prompt))
+
+
+def install(ttft: float = None, tokens_per_sec: float = None, answer_tokens: int = None):
+    """Подменяет модель Gemini фейковой; параметры None оставляют значения по умолчанию."""
+    if ttft is not None:
+        profile.ttft = ttft
+    if tokens_per_sec is not None:
+        profile.tokens_per_sec = tokens_per_sec
+    if answer_tokens is not None:
+        profile.answer_tokens = answer_tokens
+    genai.GenerativeModel = FakeGenerativeModel
@@ -0,0 +1,259 @@
+"""
+Нагрузочный тест приложения со смешанным трафиком и фейковым Gemini.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_test --concurrency 1,8,32,64 --duration 15 --poems 2000 --users 100
+
+Во временной базе (или --database-url) создаются синтетические каталог,
+пользователи и истории чатов (benchmarks.seed), затем в отдельном процессе
+поднимается uvicorn с фейковой моделью (benchmarks.serve). На каждом уровне
+конкурентности N виртуальных пользователей в течение --duration секунд
+выбирают запросы по весам MIX: каталог и страница стиха (анонимно и после
+входа), вход, /ai-ask со стримом и /chat/{id}.
+
+Отчет по уровню: RPS, ошибки, отказы планировщика (429) и p50/p95/p99
+задержки по типам запросов; для /ai-ask еще TTFB (первый байт ответа) и
+TTFT (первый блок текста модели). --json сохраняет результаты для сравнения
+между прогонами.
+
+Лимиты ИИ на пользователя в сервере по умолчанию сняты, чтобы мерить
+пропускную способность, а не token bucket; --keep-rate-limits их оставляет.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# Доли запросов в смеси; *_anon — без cookie (кэш страниц), остальные от вошедшего пользователя
+MIX = {
+    "index_anon": 15,
+    "index": 15,
+    "poem_anon": 15,
+    "poem": 15,
+    "login": 3,
+    "ai_ask": 17,
+    "chat": 20,
+}
+
+SESSION_RE = re.compile(r'currentSessionId = "([^"]+)"')
+
+
+class ScenarioStats:
+    def __init__(self):
+        self.latencies = []
+        self.ttfb = []
+        self.ttft = []
+        self.errors = 0
+        self.rejected = 0
+
+
+def _percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+
+class VirtualUser:
+    def __init__(self, base_url: str, username: str, password: str, poem_ids: list, rng: random.Random):
+        self.username = username
+        self.password = password
+        self.poem_ids = poem_ids
+        self.rng = rng
+        self.session_id = None
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=120)
+        self.anon = httpx.AsyncClient(base_url=base_url, timeout=120)
+
+    async def close(self):
+        await self.client.aclose()
+        await self.anon.aclose()
+
+    async def login(self) -> int:
+        response = await self.client.post("/auth/login", data={"username": self.username, "password": self.password})
+        return 200 if response.status_code == 303 else response.status_code
+
+    async def index_anon(self, stats):
+        return (await self.anon.get("/")).status_code
+
+    async def index(self, stats):
+        return (await self.client.get("/")).status_code
+
+    async def poem_anon(self, stats):
+        return (await self.anon.get(f"/poem/{self.rng.choice(self.poem_ids)}")).status_code
+
+    async def poem(self, stats):
+        response = await self.client.get(f"/poem/{self.rng.choice(self.poem_ids)}")
+        match = SESSION_RE.search(response.text)
+        if match:
+            self.session_id = match.group(1)
+        return response.status_code
+
+    async def chat(self, stats):
+        if self.session_id is None:
+            await self.poem(stats)
+        return (await self.client.get(f"/chat/{self.session_id}")).status_code
+
+    async def ai_ask(self, stats):
+        if self.session_id is None:
+            await self.poem(stats)
+        question = f"Какой размер у строфы {self.rng.randint(1, 8)}?"
+        started = time.perf_counter()
+        first_byte = first_token = None
+        async with self.client.stream("POST", "/ai-ask", json={"question": question, "session_id": self.session_id}) as response:
+            async for text in response.aiter_text():
+                now = time.perf_counter()
+                if first_byte is None:
+                    first_byte = now
+                # Первое событие с id несет первый блок текста модели
+                if first_token is None and "id: " in text:
+                    first_token = now
+            status = response.status_code
+        if status == 200 and first_byte is not None:
+            stats.ttfb.append(first_byte - started)
+            if first_token is not None:
+                stats.ttft.append(first_token - started)
+        return status
+
+
+async def _run_level(base_url: str, concurrency: int, duration: float, usernames: list, password: str, poem_ids: list, seed: int):
+    stats = {name: ScenarioStats() for name in MIX}
+    names, weights = list(MIX), list(MIX.values())
+    users = [
+        VirtualUser(base_url, usernames[i % len(usernames)], password, poem_ids, random.Random(seed + i))
+        for i in range(concurrency)
+    ]
+    # Вход до замера: bcrypt на старте не должен попадать в цифры уровня
+    await asyncio.gather(*(user.login() for user in users))
+
+    deadline = time.perf_counter() + duration
+
+    async def drive(user: VirtualUser):
+        while time.perf_counter() < deadline:
+            name = user.rng.choices(names, weights)[0]
+            scenario = stats[name]
+            started = time.perf_counter()
+            try:
+                status = await (user.login() if name == "login" else getattr(user, name)(scenario))
+            except httpx.HTTPError:
+                status = None
+            scenario.latencies.append(time.perf_counter() - started)
+            if status == 429:
+                scenario.rejected += 1
+            elif status is None or status >= 400:
+                scenario.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(user) for user in users))
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(user.close() for user in users))
+    return elapsed, stats
+
+
+def _report(concurrency: int, elapsed: float, stats: dict) -> dict:
+    total = sum(len(s.latencies) for s in stats.values())
+    errors = sum(s.errors for s in stats.values())
+    rejected = sum(s.rejected for s in stats.values())
+    print(f"\nconcurrency {concurrency}: {total / elapsed:8.1f} req/s | requests {total} | errors {errors} | 429 {rejected}")
+    print(f"  {'scenario':<11} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    result = {"concurrency": concurrency, "rps": round(total / elapsed, 2), "errors": errors, "rejected": rejected, "scenarios": {}}
+    for name, s in stats.items():
+        row = {
+            "count": len(s.latencies), "errors": s.errors, "rejected": s.rejected,
+            "p50_ms": round(_percentile(s.latencies, 0.5), 1),
+            "p95_ms": round(_percentile(s.latencies, 0.95), 1),
+            "p99_ms": round(_percentile(s.latencies, 0.99), 1),
+        }
+        print(f"  {name:<11} {row['count']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        if s.ttfb:
+            row.update({
+                "ttfb_p50_ms": round(_percentile(s.ttfb, 0.5), 1), "ttfb_p95_ms": round(_percentile(s.ttfb, 0.95), 1),
+                "ttft_p50_ms": round(_percentile(s.ttft, 0.5), 1), "ttft_p95_ms": round(_percentile(s.ttft, 0.95), 1),
+            })
+            print(f"  {'':<11} stream TTFB p50 {row['ttfb_p50_ms']:.1f} / p95 {row['ttfb_p95_ms']:.1f} ms,"
+                  f" TTFT p50 {row['ttft_p50_ms']:.1f} / p95 {row['ttft_p95_ms']:.1f} ms")
+        result["scenarios"][name] = row
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, process, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("benchmark server exited during startup")
+        try:
+            if httpx.get(base_url + "/", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("benchmark server did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32,64", help="уровни конкурентности через запятую")
+    parser.add_argument("--duration", type=float, default=15, help="длительность уровня, сек")
+    parser.add_argument("--poems", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=3, help="сессий чата на пользователя")
+    parser.add_argument("--messages", type=int, default=20, help="сообщений в сессии")
+    parser.add_argument("--ttft", type=float, default=0.5, help="TTFT фейковой модели, сек")
+    parser.add_argument("--tps", type=float, default=60.0, help="скорость фейковой модели, токенов/сек")
+    parser.add_argument("--database-url", help="по умолчанию — временная SQLite")
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    if not args.keep_rate_limits:
+        env["AI_USER_REQUESTS_PER_MINUTE"] = "1000000"
+        env["AI_USER_BURST"] = "1000000"
+    # Настройки читаются при импорте, поэтому окружение выставляем до seed
+    os.environ.update(env)
+    from benchmarks.seed import seed, PASSWORD
+
+    data = seed(args.poems, args.users, args.sessions, args.messages)
+    print(f"seeded {len(data['poem_ids'])} poems, {len(data['usernames'])} users in {data['seconds']}s")
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve", "--port", str(port), "--ttft", str(args.ttft), "--tps", str(args.tps)],
+        env=env
+    )
+    results = []
+    try:
+        _wait_ready(base_url, server)
+        print(f"fake model: TTFT {args.ttft}s, {args.tps} tokens/s")
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            elapsed, stats = asyncio.run(
+                _run_level(base_url, level, args.duration, data["usernames"], PASSWORD, data["poem_ids"], seed=level)
+            )
+            results.append(_report(level, elapsed, stats))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        tmp.cleanup()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
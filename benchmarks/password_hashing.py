@@ -0,0 +1,73 @@
+"""
+Задержка event loop во время «шторма» логинов.
+
+Запуск из корня проекта:
+    python -m benchmarks.password_hashing --logins 40
+
+Параллельно с N проверками пароля работает «пульс», который каждые 10 мс
+засыпает и измеряет, насколько позже запланированного проснулся. Сравниваются
+прямой вызов bcrypt в корутине (как было раньше) и вынос в пул security.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import security
+
+TICK = 0.01
+
+
+async def _heartbeat(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def _storm(logins: int, offloaded: bool, hashed: str):
+    async def inline_login():
+        security.verify_password("secret", hashed)
+
+    async def pooled_login():
+        try:
+            await security.verify_and_update_password("secret", hashed)
+        except security.PasswordHasherBusy:
+            rejected.append(1)
+
+    login = pooled_login if offloaded else inline_login
+    lags = []
+    rejected = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(stop, lags))
+    await asyncio.sleep(TICK * 3)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await heartbeat
+    return elapsed, lags, len(rejected)
+
+
+def _report(title: str, elapsed: float, lags: list, rejected: int):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"{title:<22} total {elapsed:6.2f}s | loop lag p50 {statistics.median(lags_ms):7.1f} ms"
+          f" | p99 {p99:7.1f} ms | max {lags_ms[-1]:7.1f} ms | rejected {rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40, help="одновременных логинов")
+    args = parser.parse_args()
+
+    hashed = security.hash_password("secret")
+    print(f"bcrypt rounds={security.settings.BCRYPT_ROUNDS}, pool workers={security.settings.PASSWORD_HASH_WORKERS}, logins={args.logins}")
+    _report("inline (event loop)", *asyncio.run(_storm(args.logins, False, hashed)))
+    _report("bounded thread pool", *asyncio.run(_storm(args.logins, True, hashed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Проверка планов горячих запросов к чатам через EXPLAIN QUERY PLAN (SQLite).
+
+Запуск из корня проекта:
+    python -m benchmarks.query_plans --messages 20000
+
+Во временной базе создается схема «как до индексов» (create_all, затем
+индексы удаляются), поверх нее применяются migrations.upgrade, база
+заполняется данными, и для каждого запроса из queries.py проверяется,
+что SQLite идет по ожидаемому индексу, не сканирует таблицу целиком и не
+сортирует во временном B-дереве. При регрессии код возврата — 1.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+import migrations
+import models
+import queries
+
+# (название, выражение, индекс, который должен быть в плане)
+HOT_QUERIES = [
+    ("poem_detail: последняя сессия", queries.latest_session(7, 3), "ix_chat_sessions_user_poem_created"),
+    ("sidebar: первая страница", queries.sidebar_sessions(7).limit(31), "ix_chat_sessions_user_created_id"),
+    ("sidebar: следующая страница", queries.sidebar_sessions(7, (datetime(2026, 1, 1), "s-7-3-0")).limit(31),
+     "ix_chat_sessions_user_created_id"),
+    ("poem_detail: сообщения сессии", queries.session_messages("s-7-3-0"), "ix_chat_messages_session_created"),
+    ("ask_ai: окно после summary", queries.session_messages("s-7-3-0", after_id=100), "ix_chat_messages_session_created"),
+    ("get_chat_history", queries.owned_session_messages("s-7-3-0", 7), "ix_chat_messages_session_created"),
+]
+
+NEW_INDEXES = [index for _, _, index in HOT_QUERIES]
+
+
+def _seed(engine, users: int, poems: int, messages: int):
+    started = datetime.utcnow() - timedelta(days=30)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": u, "username": f"user{u}", "hashed_password": "x", "is_admin": False} for u in range(1, users + 1)
+        ])
+        connection.execute(models.Poem.__table__.insert(), [
+            {"id": p, "title": f"Poem {p}", "author": "Author", "content": "text"} for p in range(1, poems + 1)
+        ])
+        sessions = [
+            {"id": f"s-{u}-{p}-{n}", "user_id": u, "poem_id": p, "created_at": started + timedelta(minutes=rng.randint(0, 40000))}
+            for u in range(1, users + 1) for p in rng.sample(range(1, poems + 1), min(poems, 5)) for n in range(2)
+        ]
+        connection.execute(models.ChatSession.__table__.insert(), sessions)
+        connection.execute(models.ChatMessage.__table__.insert(), [
+            {"session_id": rng.choice(sessions)["id"], "role": "user" if i % 2 == 0 else "model",
+             "content": "...", "created_at": started + timedelta(seconds=i)}
+            for i in range(messages)
+        ])
+        connection.exec_driver_sql("ANALYZE")
+
+
+def _plan(connection, stmt) -> list:
+    sql = str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def _problems(plan: list, index: str) -> list:
+    problems = []
+    if not any(index in step for step in plan):
+        problems.append(f"не использует {index}")
+    for step in plan:
+        # «SCAN t USING INDEX» допустим, голый «SCAN t» — полный перебор таблицы
+        if step.startswith("SCAN ") and "USING" not in step:
+            problems.append(f"полный перебор: {step}")
+        if "TEMP B-TREE" in step:
+            problems.append(f"сортировка без индекса: {step}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--poems", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'plans.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        # Имитируем уже развернутую базу без новых индексов — их должна добавить миграция
+        with engine.begin() as connection:
+            for index in set(NEW_INDEXES):
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+        print(f"Applied migrations: {', '.join(migrations.upgrade(engine)) or '-'}")
+
+        _seed(engine, args.users, args.poems, args.messages)
+
+        failed = False
+        with engine.connect() as connection:
+            for title, stmt, index in HOT_QUERIES:
+                plan = _plan(connection, stmt)
+                started = time.perf_counter()
+                connection.execute(stmt).all()
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                problems = _problems(plan, index)
+                failed = failed or bool(problems)
+                print(f"{'FAIL' if problems else 'ok':<4} {title:<36} {elapsed_ms:7.2f} ms")
+                for step in plan:
+                    print(f"       {step}")
+                for problem in problems:
+                    print(f"       ! {problem}")
+        engine.dispose()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Синтетические данные для нагрузочных тестов: каталог стихов, пользователи и истории чатов.
+
+Запуск из корня проекта (пишет в DATABASE_URL из окружения/.env):
+    python -m benchmarks.seed --poems 5000 --users 200 --sessions 5 --messages 40
+
+У всех пользователей пароль PASSWORD; хэш bcrypt считается один раз.
+Данные пишутся пачками через Core insert, без ORM и без commit на строку.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+PASSWORD = "benchmark"
+USERNAME_PREFIX = "bench"
+BATCH = 2000
+
+LINES = [
+    "Мороз и солнце; день чудесный!", "Еще ты дремлешь, друг прелестный", "Я помню чудное мгновенье",
+    "Передо мной явилась ты", "Белеет парус одинокой", "В тумане моря голубом",
+    "Ночь, улица, фонарь, аптека", "Бессмысленный и тусклый свет", "Не выходи из комнаты, не совершай ошибку",
+    "Гул затих. Я вышел на подмостки", "Шепот, робкое дыханье", "Трели соловья",
+]
+
+
+def _poem(rng, i: int) -> dict:
+    lines = [rng.choice(LINES) for _ in range(rng.randint(8, 32))]
+    return {"title": f"Стихотворение №{i}", "author": f"Автор {i % 97}", "content": "\n".join(lines)}
+
+
+def _chunks(rows, size: int = BATCH):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def seed(poems: int, users: int, sessions: int, messages: int, rng_seed: int = 0) -> dict:
+    """Создает схему и заполняет базу; возвращает сводку (id стихов и имена пользователей)."""
+    from database import engine
+    import models, migrations, security
+
+    migrations.setup_schema(engine)
+
+    rng = random.Random(rng_seed)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        first_poem_id = (connection.exec_driver_sql("SELECT coalesce(max(id), 0) FROM poems").scalar() or 0) + 1
+        for rows in _chunks([_poem(rng, first_poem_id + i) for i in range(poems)]):
+            connection.execute(models.Poem.__table__.insert(), rows)
+        poem_ids = list(range(first_poem_id, first_poem_id + poems))
+
+        hashed = security.hash_password(PASSWORD)
+        first_user_id = (connection.exec_driver_sql("SELECT coalesce(max(id), 0) FROM users").scalar() or 0) + 1
+        user_rows = [
+            {"id": first_user_id + i, "username": f"{USERNAME_PREFIX}{first_user_id + i}", "hashed_password": hashed, "is_admin": False}
+            for i in range(users)
+        ]
+        for rows in _chunks(user_rows):
+            connection.execute(models.User.__table__.insert(), rows)
+
+        now = datetime.utcnow()
+        session_rows, message_rows = [], []
+        for user in user_rows:
+            for _ in range(sessions if poem_ids else 0):
+                session_id = models.default_uuid()
+                created_at = now - timedelta(minutes=rng.randint(60, 60 * 24 * 30))
+                last_at = created_at + timedelta(seconds=messages * 30)
+                session_rows.append({
+                    "id": session_id, "user_id": user["id"], "poem_id": rng.choice(poem_ids),
+                    "created_at": created_at, "message_count": messages,
+                    "last_message_at": last_at if messages else None,
+                    "last_message_preview": "Синтетический ответ" if messages else None,
+                })
+                for m in range(messages):
+                    message_rows.append({
+                        "session_id": session_id, "role": "user" if m % 2 == 0 else "model",
+                        "content": ("Вопрос про строфу %d?" % m) if m % 2 == 0 else " ".join(rng.choice(LINES) for _ in range(6)),
+                        "created_at": created_at + timedelta(seconds=m * 30),
+                    })
+                if len(message_rows) >= BATCH:
+                    connection.execute(models.ChatSession.__table__.insert(), session_rows)
+                    connection.execute(models.ChatMessage.__table__.insert(), message_rows)
+                    session_rows, message_rows = [], []
+        if session_rows:
+            connection.execute(models.ChatSession.__table__.insert(), session_rows)
+        if message_rows:
+            connection.execute(models.ChatMessage.__table__.insert(), message_rows)
+
+    return {
+        "poem_ids": poem_ids,
+        "usernames": [user["username"] for user in user_rows],
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--poems", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=3, help="сессий чата на пользователя")
+    parser.add_argument("--messages", type=int, default=20, help="сообщений в сессии")
+    args = parser.parse_args()
+
+    summary = seed(args.poems, args.users, args.sessions, args.messages)
+    print(f"Seeded {len(summary['poem_ids'])} poems, {len(summary['usernames'])} users "
+          f"({args.sessions} sessions x {args.messages} messages each) in {summary['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
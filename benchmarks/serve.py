@@ -0,0 +1,30 @@
+"""
+Приложение с фейковым Gemini вместо настоящего (см. fake_gemini).
+
+Запуск из корня проекта:
+    python -m benchmarks.serve --port 8001 --ttft 0.5 --tps 60
+
+Используется нагрузочным тестом, но годится и для ручной проверки UI без ключа API.
+"""
+import argparse
+
+import uvicorn
+
+from benchmarks import fake_gemini
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.5, help="задержка до первого блока ответа, сек")
+    parser.add_argument("--tps", type=float, default=60.0, help="скорость генерации, токенов в секунду")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="длина ответа в токенах")
+    args = parser.parse_args()
+
+    fake_gemini.install(ttft=args.ttft, tokens_per_sec=args.tps, answer_tokens=args.answer_tokens)
+    uvicorn.run("main:app", host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Время импорта и запуска воркера.
+
+Запуск из корня проекта:
+    python -m benchmarks.startup_time --runs 5
+
+Каждый замер — в свежем интерпретаторе, как при старте воркера или
+холодном старте при автомасштабировании. Этапы:
+- import main: импорт приложения вместе с create_app();
+- lifespan: проверка схемы, выбор поиска и прогрев шаблонов — до первого запроса;
+- первый запрос к ИИ: ленивый импорт и настройка SDK Gemini (ai_service.sdk).
+Шаблоны меряются с пустым кэшем байткода (первый воркер после деплоя) и
+с заполненным (все следующие). --importtime печатает самые тяжелые модули.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = r"""
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def run_lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+
+asyncio.run(run_lifespan())
+ready = time.perf_counter()
+import ai_service
+ai_service.sdk()
+sdk_loaded = time.perf_counter()
+print(json.dumps({"import": imported - started, "lifespan": ready - imported, "ai_sdk": sdk_loaded - ready}))
+"""
+
+
+def _measure(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", CHILD], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _report(title: str, samples: list):
+    print(f"\n{title}")
+    for phase in ("import", "lifespan", "ai_sdk"):
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f"  {phase:<9} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+
+
+def _heaviest_imports(env: dict, top: int):
+    stderr = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import main"], env=env, capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    print("\nheaviest imports of main (cumulative):")
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=10, help="сколько модулей показать (0 — не показывать)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        env["TEMPLATE_BYTECODE_CACHE_DIR"] = os.path.join(tmp, "jinja")
+        subprocess.run([sys.executable, "-W", "ignore", "migrations.py"], env=env, check=True, capture_output=True)
+
+        cold = []
+        cache_dir = env["TEMPLATE_BYTECODE_CACHE_DIR"]
+        for _ in range(args.runs):
+            if os.path.isdir(cache_dir):
+                for name in os.listdir(cache_dir):
+                    os.remove(os.path.join(cache_dir, name))
+            cold.append(_measure(env))
+        warm = [_measure(env) for _ in range(args.runs)]
+
+        _report("empty template bytecode cache", cold)
+        _report("warm template bytecode cache", warm)
+        if args.importtime:
+            _heaviest_imports(env, args.importtime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Холодный слой истории чатов: сообщения давно неактивных сессий в сжатом виде.
+
+Сессия, в которой не было сообщений дольше CHAT_ARCHIVE_IDLE_DAYS,
+переносится из chat_messages в одну строку chat_archives — JSON всех
+сообщений, сжатый zlib. Горячая таблица и ее индексы остаются маленькими, а
+текст, который почти никогда не читают, занимает в разы меньше места.
+
+Чтение прозрачно: /chat/{id} показывает архив, не распаковывая его в БД,
+а при открытии сессии на странице стиха или новом вопросе (restore) сообщения
+возвращаются в chat_messages, и дальше сессия работает как обычно.
+
+Запуск (например, раз в сутки по cron):
+    python chat_archive.py [--idle-days 30] [--vacuum]
+
+--vacuum после архивации возвращает освободившееся место: без него SQLite
+переиспользует страницы, но файл базы не уменьшается.
+"""
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from config import settings
+from database import session_scope
+import models, queries
+
+
+def pack(messages) -> tuple:
+    """Сжатый блок и размер исходного JSON для списка ChatMessage."""
+    raw = json.dumps(
+        [[m.id, m.role, m.content, m.created_at.isoformat() if m.created_at else None] for m in messages],
+        ensure_ascii=False
+    ).encode("utf-8")
+    return zlib.compress(raw, settings.CHAT_ARCHIVE_COMPRESSION_LEVEL), len(raw)
+
+
+def unpack(data: bytes) -> list:
+    """Сообщения из архивного блока: [{id, role, content, created_at}] по порядку."""
+    return [
+        {"id": id, "role": role, "content": content,
+         "created_at": datetime.fromisoformat(created_at) if created_at else None}
+        for id, role, content, created_at in json.loads(zlib.decompress(data))
+    ]
+
+
+def idle_sessions(cutoff: datetime, after_id: str = "", limit: int = None):
+    """Неархивированные сессии с сообщениями, где последнее сообщение старше cutoff."""
+    last_activity = func.coalesce(models.ChatSession.last_message_at, models.ChatSession.created_at)
+    return select(models.ChatSession.id).where(
+        models.ChatSession.archived_at.is_(None),
+        models.ChatSession.message_count > 0,
+        last_activity < cutoff,
+        models.ChatSession.id > after_id
+    ).order_by(models.ChatSession.id).limit(limit or settings.CHAT_ARCHIVE_BATCH)
+
+
+async def archive_session(session_id: str, cutoff: datetime):
+    """
+    Переносит сообщения сессии в архив одной транзакцией.
+
+    Возвращает (сообщений, байт JSON, байт в архиве) или None, если сессию
+    трогать нельзя: в ней идет ответ модели или появились новые сообщения.
+    """
+    async with session_scope() as db:
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.AI_STREAM_STALE_AFTER)
+        streaming = await db.scalar(select(models.ChatStream.id).where(
+            models.ChatStream.session_id == session_id,
+            models.ChatStream.status == "streaming",
+            models.ChatStream.updated_at > stale_before
+        ).limit(1))
+        if streaming is not None:
+            return None
+        messages = (await db.scalars(queries.session_messages(session_id))).all()
+        if not messages or (messages[-1].created_at and messages[-1].created_at >= cutoff):
+            return None
+
+        data, raw_bytes = pack(messages)
+        last_id = max(message.id for message in messages)
+        # Стримы ссылаются на сообщения; у сессии старше порога они все давно завершены
+        await db.execute(delete(models.ChatStream).where(models.ChatStream.session_id == session_id))
+        # Только заархивированные: запись, пришедшая после выборки, останется в горячей таблице
+        await db.execute(delete(models.ChatMessage).where(
+            models.ChatMessage.session_id == session_id,
+            models.ChatMessage.id <= last_id
+        ))
+        db.add(models.ChatArchive(session_id=session_id, data=data, message_count=len(messages), raw_bytes=raw_bytes))
+        await db.execute(update(models.ChatSession).where(models.ChatSession.id == session_id).values(
+            archived_at=datetime.utcnow()
+        ))
+        await db.commit()
+    return len(messages), raw_bytes, len(data)
+
+
+async def run(idle_days: int = None) -> dict:
+    """Архивирует все сессии, неактивные дольше idle_days; возвращает итоги."""
+    idle_days = settings.CHAT_ARCHIVE_IDLE_DAYS if idle_days is None else idle_days
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    totals = {"sessions": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    after_id = ""
+    while True:
+        async with session_scope() as db:
+            session_ids = (await db.scalars(idle_sessions(cutoff, after_id))).all()
+        if not session_ids:
+            return totals
+        for session_id in session_ids:
+            archived = await archive_session(session_id, cutoff)
+            if archived is not None:
+                totals["sessions"] += 1
+                totals["messages"] += archived[0]
+                totals["raw_bytes"] += archived[1]
+                totals["stored_bytes"] += archived[2]
+        after_id = session_ids[-1]
+
+
+async def restore(db, session_id: str) -> bool:
+    """
+    Возвращает сообщения сессии из архива в chat_messages.
+
+    Архив забирается удалением строки, поэтому два одновременных запроса
+    не распакуют его дважды. Сообщения получают новые id, и граница уже
+    свернутой в summary части переносится на них.
+    """
+    data = await db.scalar(select(models.ChatArchive.data).where(models.ChatArchive.session_id == session_id))
+    if data is None:
+        return False
+    claimed = await db.execute(delete(models.ChatArchive).where(models.ChatArchive.session_id == session_id))
+    if claimed.rowcount != 1:
+        await db.rollback()
+        return False
+
+    rows = unpack(data)
+    restored = [
+        models.ChatMessage(session_id=session_id, role=row["role"], content=row["content"], created_at=row["created_at"])
+        for row in rows
+    ]
+    db.add_all(restored)
+    await db.flush()
+
+    summary = await db.get(models.ChatSummary, session_id)
+    if summary is not None and rows and 0 < summary.summarized_until_id <= max(row["id"] for row in rows):
+        covered = [message.id for row, message in zip(rows, restored) if row["id"] <= summary.summarized_until_id]
+        summary.summarized_until_id = covered[-1] if covered else 0
+    await db.execute(update(models.ChatSession).where(models.ChatSession.id == session_id).values(archived_at=None))
+    await db.commit()
+    return True
+
+
+async def archived_messages(db, session_id: str, user_id: int) -> list:
+    """Сообщения из архива сессии пользователя без распаковки в БД (для просмотра)."""
+    data = await db.scalar(
+        select(models.ChatArchive.data)
+        .join(models.ChatSession, models.ChatSession.id == models.ChatArchive.session_id)
+        .where(models.ChatArchive.session_id == session_id, models.ChatSession.user_id == user_id)
+    )
+    return unpack(data) if data is not None else []
+
+
+def vacuum(engine):
+    """Переписывает базу, чтобы файл SQLite уменьшился (в Postgres — обычный VACUUM)."""
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from database import engine, is_sqlite
+
+    parser = argparse.ArgumentParser(description="Архивация давно неактивных сессий чата")
+    parser.add_argument("--idle-days", type=int, default=settings.CHAT_ARCHIVE_IDLE_DAYS)
+    parser.add_argument("--vacuum", action="store_true", help="после архивации сжать файл базы")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args.idle_days))
+    print(f"Archived {summary['sessions']} sessions ({summary['messages']} messages): "
+          f"{summary['raw_bytes']} bytes of text stored as {summary['stored_bytes']}")
+    if args.vacuum:
+        path = engine.url.database if is_sqlite else None
+        size_before = os.path.getsize(path) if path and os.path.exists(path) else None
+        vacuum(engine)
+        if size_before is not None:
+            print(f"Database file: {size_before} -> {os.path.getsize(path)} bytes")
@@ -0,0 +1,145 @@
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from config import settings
+from database import session_scope
+import ai_service
+import models, schemas, queries
+
+# Сессии, для которых прямо сейчас идет сворачивание истории (в пределах воркера)
+_compacting = set()
+# Сколько токенов оставляем каждой реплике, которая не влезла в бюджет целиком
+MIN_TURN_TOKENS = 50
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: у Gemini в среднем ~4 символа на токен."""
+    return len(text or "") // 4 + 1
+
+
+def select_window(messages: list, token_budget: int = None, max_messages: int = None) -> list:
+    """
+    Возвращает хвост истории, который отправляется модели дословно.
+
+    Идем с конца, пока укладываемся в бюджет токенов и лимит реплик.
+    Окно всегда начинается с реплики пользователя, чтобы после пары с
+    summary роли чередовались корректно. Последняя пара (вопрос и ответ)
+    входит в окно, даже если одна длинная реплика больше всего бюджета.
+    """
+    token_budget = token_budget or settings.AI_HISTORY_TOKEN_BUDGET
+    max_messages = max_messages or settings.AI_HISTORY_MAX_MESSAGES
+
+    start = len(messages)
+    used = 0
+    while start > 0 and len(messages) - start < max_messages:
+        cost = estimate_tokens(messages[start - 1].content)
+        if used + cost > token_budget:
+            break
+        used += cost
+        start -= 1
+
+    while start < len(messages) and messages[start].role != "user":
+        start += 1
+    if start == len(messages):
+        last_user = [index for index, message in enumerate(messages) if message.role == "user"]
+        if last_user:
+            start = last_user[-1]
+    return messages[start:]
+
+
+def _excerpt(text: str, tokens: int) -> str:
+    """Начало текста примерно на tokens токенов."""
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:max(0, tokens - 1) * 4].rstrip() + " […]"
+
+
+def fit_turns(messages: list, token_budget: int = None) -> list:
+    """
+    Реплики для модели в пределах бюджета токенов.
+
+    Новые реплики идут целиком, пока хватает бюджета; более старые и
+    слишком длинные сокращаются до начала текста, но не выбрасываются.
+    """
+    remaining = token_budget or settings.AI_HISTORY_TOKEN_BUDGET
+    turns = []
+    for index in range(len(messages) - 1, -1, -1):
+        # Каждой более старой реплике оставляем хотя бы MIN_TURN_TOKENS
+        allowed = max(MIN_TURN_TOKENS, remaining - MIN_TURN_TOKENS * index)
+        content = _excerpt(messages[index].content or "", allowed)
+        remaining -= estimate_tokens(content)
+        turns.append(schemas.ChatTurn(role=messages[index].role, content=content))
+    turns.reverse()
+    return turns
+
+
+async def load_context(db, session_id: str):
+    """
+    Контекст для очередного хода: (summary, реплики после него, есть ли в сессии история).
+
+    Модель здесь не вызывается, поэтому время до первого токена не зависит
+    от длины сессии. Реплики, которые вышли за окно, но еще не свернуты
+    фоновой задачей (их меньше AI_SUMMARY_BATCH_MESSAGES), идут в промпт
+    сокращенными, а не пропадают.
+    """
+    summary = await db.get(models.ChatSummary, session_id)
+    summarized_until_id = summary.summarized_until_id if summary else 0
+
+    messages = (await db.scalars(queries.session_messages(session_id, after_id=summarized_until_id))).all()
+    has_history = summary is not None or bool(messages)
+
+    # Роли после пары с summary должны чередоваться с реплики пользователя
+    start = 0
+    while start < len(messages) and messages[start].role != "user":
+        start += 1
+    return (summary.content if summary else None), fit_turns(messages[start:]), has_history
+
+
+async def compact_session(session_id: str):
+    """
+    Сворачивает в summary реплики, вышедшие за пределы окна.
+
+    Запускается фоном после ответа модели. В модель уходят только новые
+    реплики и прежний summary, так что summary обновляется инкрементально.
+    На время вызова модели сессия БД закрыта, поэтому новый summary
+    записывается, только если за это время его никто не сдвинул.
+    """
+    if session_id in _compacting:
+        return
+    _compacting.add(session_id)
+    try:
+        async with session_scope() as db:
+            summary = await db.get(models.ChatSummary, session_id)
+            previous = summary.content if summary else ""
+            summarized_until_id = summary.summarized_until_id if summary else 0
+
+            messages = (await db.scalars(queries.session_messages(session_id, after_id=summarized_until_id))).all()
+
+        overflow = messages[:len(messages) - len(select_window(messages))]
+        if len(overflow) < settings.AI_SUMMARY_BATCH_MESSAGES:
+            return
+
+        new_summary = await ai_service.summarize_history(
+            previous, [schemas.ChatTurn(role=msg.role, content=msg.content) for msg in overflow]
+        )
+        if not new_summary:
+            return
+
+        async with session_scope() as db:
+            if summary is None:
+                db.add(models.ChatSummary(
+                    session_id=session_id, content=new_summary, summarized_until_id=overflow[-1].id
+                ))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # Summary успели создать в другом воркере — его результат и оставляем
+                    await db.rollback()
+                return
+            await db.execute(update(models.ChatSummary).where(
+                models.ChatSummary.session_id == session_id,
+                models.ChatSummary.summarized_until_id == summarized_until_id
+            ).values(content=new_summary, summarized_until_id=overflow[-1].id, updated_at=datetime.utcnow()))
+            await db.commit()
+    finally:
+        _compacting.discard(session_id)
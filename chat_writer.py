@@ -0,0 +1,271 @@
+import asyncio
+import time
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from config import settings
+from database import session_scope
+import models, queries
+
+# Повтор записи хода после временной ошибки (например, "database is locked"):
+# задержка удваивается с каждой неудачей, но не больше RETRY_MAX_DELAY секунд
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+
+
+class _PendingTurn:
+    """Ход чата (вопрос + ответ модели), изменения которого еще не записаны в БД."""
+
+    def __init__(self, stream_id: str, session_id: str, question: str):
+        self.stream_id = stream_id
+        self.session_id = session_id
+        self.question = question
+        self.created_at = datetime.utcnow()
+        self.content = ""
+        self.status = "streaming"
+        # id сообщения модели; None, пока ход не вставлен в БД
+        self.message_id = None
+        # Номер последнего изменения и последнего записанного
+        self.version = 1
+        self.flushed = 0
+        # Неудачные попытки записи подряд и когда пробовать снова (time.monotonic)
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed
+
+
+class ChatWriter:
+    """
+    Отложенная запись ходов чата пачками.
+
+    Роутер и стрим только меняют состояние хода в памяти, а фоновая задача
+    раз в flush_interval записывает все накопившиеся изменения всех чатов
+    одной транзакцией: вставку вопроса, сообщения модели и ChatStream,
+    контрольные точки ответа и сводку сессии. Под SQLite это один захват
+    блокировки записи и один fsync вместо отдельного commit на каждый чат.
+
+    Чтение своих записей: перед чтением истории сессии вызывается sync(),
+    который дожидается записи ее отложенных изменений (в пределах воркера).
+
+    Ход, который не удалось записать из-за временной ошибки, остается в
+    очереди и повторяется с растущей задержкой; выбрасывается только ход,
+    который БД отвергает по ограничениям целостности (например, сессию удалили).
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._turns = {}
+        self._task = None
+        self._loop = None
+        self._closing = False
+        self._dirty = None
+        self._urgent = None
+        self._flushed = None
+        self._batches = 0
+        self._written = 0
+        self._dropped = 0
+        self._retries = 0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        # Задача привязана к своему event loop; в новом loop (тесты, перезапуск) заводим ее заново
+        if self._closing or (self._task is not None and self._loop is loop):
+            return
+        self._loop = loop
+        self._dirty = asyncio.Event()
+        self._urgent = asyncio.Event()
+        self._flushed = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+        if self._pending():
+            self._dirty.set()
+
+    def add_turn(self, session_id: str, question: str) -> str:
+        """Ставит в очередь новый ход; возвращает id стрима ответа."""
+        self._ensure_started()
+        turn = _PendingTurn(models.default_uuid(), session_id, question)
+        self._turns[turn.stream_id] = turn
+        self._dirty.set()
+        return turn.stream_id
+
+    def update(self, stream_id: str, content: str, status: str = None):
+        """Новый текст ответа (и статус стрима); промежуточные версии между записями схлопываются."""
+        turn = self._turns.get(stream_id)
+        if turn is None:
+            return
+        turn.content = content
+        if status:
+            turn.status = status
+        turn.version += 1
+        self._ensure_started()
+        self._dirty.set()
+
+    def session_of(self, stream_id: str):
+        """Сессия хода, который еще в очереди этого воркера; None, если он уже записан или чужой."""
+        turn = self._turns.get(stream_id)
+        return turn.session_id if turn is not None else None
+
+    def _pending(self, session_id: str = None, include_failing: bool = True) -> bool:
+        return any(
+            turn.dirty for turn in self._turns.values()
+            if (session_id is None or turn.session_id == session_id)
+            and (include_failing or not turn.failures)
+        )
+
+    async def sync(self, session_id: str = None):
+        """
+        Дожидается записи отложенных изменений сессии (или всех, если session_id не задан).
+
+        Ходы, запись которых сейчас повторяется после ошибки, не ждем: запрос
+        не должен висеть, пока БД недоступна.
+        """
+        if not self._pending(session_id, include_failing=False):
+            return
+        self._ensure_started()
+        self._urgent.set()
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: not self._pending(session_id, include_failing=False))
+
+    async def close(self):
+        """Записывает все, что осталось в очереди, и останавливает фоновую задачу."""
+        if self._task is not None and self._loop is not asyncio.get_running_loop():
+            self._ensure_started()
+        for turn in self._turns.values():
+            if turn.status == "streaming":
+                # Ответ уже не допишется: без этого стрим в БД навсегда останется "streaming"
+                turn.status = "failed"
+                turn.version += 1
+        self._closing = True
+        if self._task is not None:
+            self._dirty.set()
+            self._urgent.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            try:
+                await asyncio.wait_for(self._urgent.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._urgent.clear()
+
+            now = time.monotonic()
+            batch = [
+                turn for turn in self._turns.values()
+                if turn.dirty and (turn.retry_at <= now or self._closing)
+            ][:self.max_batch]
+            if batch:
+                await self._flush(batch)
+            async with self._flushed:
+                self._flushed.notify_all()
+
+            if self._pending():
+                # Очередь больше одной пачки — следующую пишем сразу
+                if len(batch) == self.max_batch or self._closing:
+                    self._urgent.set()
+            else:
+                self._dirty.clear()
+                if self._closing:
+                    return
+
+    async def _flush(self, batch: list):
+        try:
+            await self._write(batch)
+        except Exception as e:
+            # Одна битая запись (например, сессию уже удалили) не должна ронять всю пачку
+            print(f"Chat batch write failed, retrying one by one: {e}")
+            for turn in batch:
+                try:
+                    await self._write([turn])
+                except Exception as e:
+                    self._write_failed(turn, e)
+
+    def _write_failed(self, turn: _PendingTurn, error: Exception):
+        # При остановке воркера ждать следующей попытки уже некому
+        if isinstance(error, IntegrityError) or self._closing:
+            print(f"Chat write dropped for stream {turn.stream_id}: {error}")
+            self._turns.pop(turn.stream_id, None)
+            self._dropped += 1
+            return
+        turn.failures += 1
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (turn.failures - 1))
+        turn.retry_at = time.monotonic() + delay
+        self._retries += 1
+        print(f"Chat write failed for stream {turn.stream_id} (attempt {turn.failures}), retrying in {delay:.1f}s: {error}")
+
+    async def _write(self, batch: list):
+        # Снимок состояния: пока идет запись, стрим может успеть обновить ход
+        snapshot = [(turn, turn.version, turn.content, turn.status) for turn in batch]
+        inserted = {}
+        async with session_scope() as db:
+            for turn, _, content, _ in snapshot:
+                if turn.message_id is None:
+                    model_message = models.ChatMessage(
+                        session_id=turn.session_id, role="model", content=content, created_at=turn.created_at
+                    )
+                    db.add_all([
+                        models.ChatMessage(
+                            session_id=turn.session_id, role="user", content=turn.question, created_at=turn.created_at
+                        ),
+                        model_message,
+                    ])
+                    inserted[turn.stream_id] = model_message
+            if inserted:
+                await db.flush()
+
+            now = datetime.utcnow()
+            for turn, _, content, status in snapshot:
+                model_message = inserted.get(turn.stream_id)
+                if model_message is not None:
+                    db.add(models.ChatStream(
+                        id=turn.stream_id, session_id=turn.session_id, message_id=model_message.id,
+                        status=status, created_at=turn.created_at, updated_at=now
+                    ))
+                    # Превью в боковой панели — вопрос, пока ответ не готов
+                    await db.execute(queries.record_messages(turn.session_id, 2, content or turn.question))
+                    continue
+                await db.execute(
+                    update(models.ChatMessage).where(models.ChatMessage.id == turn.message_id).values(content=content)
+                )
+                await db.execute(
+                    update(models.ChatStream).where(models.ChatStream.id == turn.stream_id).values(status=status, updated_at=now)
+                )
+                if status != "streaming" and content:
+                    # Ответ готов: теперь он последнее сообщение в сводке сессии
+                    await db.execute(queries.record_messages(turn.session_id, 0, content))
+            await db.commit()
+
+        self._batches += 1
+        self._written += len(snapshot)
+        for turn, version, _, _ in snapshot:
+            if turn.stream_id in inserted:
+                turn.message_id = inserted[turn.stream_id].id
+            turn.flushed = version
+            turn.failures = 0
+            turn.retry_at = 0.0
+            self._turns.pop(turn.stream_id, None)
+            if turn.status == "streaming" or turn.dirty:
+                # В конец очереди: при очереди больше пачки следующими пишутся те, кто ждет дольше
+                self._turns[turn.stream_id] = turn
+
+    def stats(self) -> dict:
+        return {
+            "pending_turns": sum(1 for turn in self._turns.values() if turn.dirty),
+            "retrying_turns": sum(1 for turn in self._turns.values() if turn.failures),
+            "tracked_turns": len(self._turns),
+            "batches": self._batches,
+            "written": self._written,
+            "dropped": self._dropped,
+            "retries": self._retries,
+        }
+
+
+writer = ChatWriter(
+    flush_interval=settings.CHAT_WRITE_FLUSH_INTERVAL,
+    max_batch=settings.CHAT_WRITE_MAX_BATCH,
+)
@@ -3,16 +3,110 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     # Параметры базы данных
     DATABASE_URL: str = "sqlite:///./database.db"
+    # True — асинхронный драйвер (aiosqlite/asyncpg), False — синхронный драйвер в пуле потоков
+    DATABASE_ASYNC: bool = True
+    # Пул соединений; при DATABASE_ASYNC=False по нему же задается число потоков БД
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    # SQLite: журнал WAL + synchronous=NORMAL и ожидание блокировки вместо ошибки
+    SQLITE_WAL: bool = True
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    # Отложенная запись сообщений чата: пачка уходит в БД одной транзакцией
+    # не позже чем через интервал (сек) и не больше N ходов за раз
+    CHAT_WRITE_FLUSH_INTERVAL: float = 0.05
+    CHAT_WRITE_MAX_BATCH: int = 100
+    # Архив чатов (chat_archive.py): сообщения сессий, неактивных дольше N дней,
+    # сжимаются в один блок на сессию и распаковываются обратно при открытии сессии
+    CHAT_ARCHIVE_IDLE_DAYS: int = 30
+    CHAT_ARCHIVE_BATCH: int = 200
+    CHAT_ARCHIVE_COMPRESSION_LEVEL: int = 6
     
+    # Кэш отрендеренных страниц для анонимных посетителей (/ и /poem/{id}).
+    # Версию каталога из БД перечитываем не чаще раза в интервал (сек) — столько
+    # другие воркеры могут отдавать старую страницу после правки в админке.
+    # max-age=0 заставляет браузер/CDN перепроверять страницу по ETag при каждом запросе
+    PAGE_CACHE_SIZE: int = 512
+    PAGE_CACHE_TTL: int = 600
+    PAGE_CACHE_MAX_AGE: int = 0
+    PAGE_CACHE_VERSION_CHECK_INTERVAL: float = 1.0
+
+    # Метрики Prometheus на /metrics; запросы дольше порога (мс) печатаются
+    # со списком SQL и разбивкой по этапам (0 — лог выключен)
+    METRICS_ENABLED: bool = True
+    METRICS_SLOW_REQUEST_MS: int = 0
+
+    # Создавать и мигрировать схему при старте приложения (удобно для разработки).
+    # По умолчанию схема готовится отдельным шагом `python migrations.py`,
+    # а воркер только проверяет, что миграции применены
+    SCHEMA_SETUP_ON_STARTUP: bool = False
+
+    # Шаблоны: каталог кэша байткода Jinja (пусто — во временной папке системы)
+    # и проверка изменений файлов шаблонов при каждом рендере
+    TEMPLATE_BYTECODE_CACHE_DIR: str = ""
+    TEMPLATE_AUTO_RELOAD: bool = True
+
+    # Конфигурация текстового поиска Postgres (to_tsvector); для SQLite используется FTS5
+    SEARCH_PG_CONFIG: str = "simple"
+
     # Параметры безопасности (JWT)
     SECRET_KEY: str = "super-secret-key-change-me-in-production"
     ALGORITHM: str = "HS256"
     # ЭТОЙ СТРОКИ НЕ ХВАТАЛО:
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Сессионная cookie с JWT и кэш пользователей (TTL в секундах)
+    SESSION_COOKIE_NAME: str = "session"
+    SESSION_EXPIRE_MINUTES: int = 60 * 24 * 14
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 60
+
+    # bcrypt: стоимость хэша и отдельный ограниченный пул потоков для него
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    PASSWORD_HASH_TIMEOUT: float = 5.0
     
     # Ключ для Google Gemini API (должен быть в .env файле)
     GOOGLE_API_KEY: str = ""
 
+    # Параметры ИИ-сервиса
+    AI_MODEL_NAME: str = "gemini-3-flash-preview"
+    # Сколько запросов к Gemini может выполняться одновременно на один воркер
+    AI_MAX_CONCURRENT_STREAMS: int = 200
+    # Кэш подготовленных моделей по стихотворению (LRU + TTL, в секундах)
+    AI_MODEL_CACHE_SIZE: int = 256
+    AI_MODEL_CACHE_TTL: int = 3600
+    # Загружать системный промпт стиха в серверный кэш контекста Gemini
+    AI_CONTEXT_CACHE: bool = False
+    # Кэш ответов на первый вопрос сессии (без истории), TTL в секундах
+    AI_ANSWER_CACHE_SIZE: int = 1024
+    AI_ANSWER_CACHE_TTL: int = 86400
+    # Планировщик /ai-ask: общий лимит, очередь с ограниченным ожиданием (сек)
+    # и token bucket на пользователя
+    AI_SCHEDULER_MAX_CONCURRENT: int = 100
+    AI_SCHEDULER_MAX_QUEUE: int = 500
+    AI_SCHEDULER_MAX_WAIT: float = 10.0
+    AI_USER_REQUESTS_PER_MINUTE: float = 12
+    AI_USER_BURST: int = 4
+    # Стандартные разборы стихов (analyses.py), которые генерируются заранее:
+    # сколько запросов к ИИ идет одновременно, сколько повторов с растущей
+    # паузой (сек) и запускать ли генерацию при добавлении/правке стиха
+    ANALYSIS_CONCURRENCY: int = 4
+    ANALYSIS_RETRIES: int = 3
+    ANALYSIS_RETRY_DELAY: float = 2.0
+    ANALYSIS_ON_SAVE: bool = True
+    # Частичный ответ сохраняется в БД не реже раза в интервал (сек) или каждые N символов
+    AI_STREAM_CHECKPOINT_INTERVAL: float = 1.0
+    AI_STREAM_CHECKPOINT_CHARS: int = 2000
+    # Стрим без обновлений дольше этого (сек) считается оборванным (например, упал воркер)
+    AI_STREAM_STALE_AFTER: int = 60
+    # Окно истории чата: последние реплики дословно в пределах бюджета токенов,
+    # более старые сворачиваются в summary пачками не меньше AI_SUMMARY_BATCH_MESSAGES
+    AI_HISTORY_TOKEN_BUDGET: int = 3000
+    AI_HISTORY_MAX_MESSAGES: int = 12
+    AI_SUMMARY_BATCH_MESSAGES: int = 4
+
     class Config:
         env_file = ".env"
 
@@ -1,15 +1,210 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from config import settings
 
-connect_args = {"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
-engine = create_engine(settings.DATABASE_URL, connect_args=connect_args)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+is_sqlite = settings.DATABASE_URL.startswith("sqlite")
+
+
+def _engine_kwargs():
+    """Параметры пула/подключения для выбранной СУБД."""
+    pool = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+    if is_sqlite:
+        # timeout драйвера sqlite3 задается в секундах; дублирует busy_timeout ниже
+        return {**pool, "connect_args": {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {**pool, "pool_recycle": settings.DB_POOL_RECYCLE, "pool_pre_ping": True}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL позволяет читателям не ждать писателя, synchronous=NORMAL убирает fsync
+    на каждый commit (в WAL это безопасно), busy_timeout заставляет ждать
+    блокировку вместо мгновенной ошибки "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    if settings.SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
+def _async_url(url: str) -> str:
+    """Подставляет асинхронный драйвер в DATABASE_URL."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+# Синхронный движок нужен всегда: create_all, CLI-скрипты и режим DATABASE_ASYNC=False
+engine = create_engine(settings.DATABASE_URL, **_engine_kwargs())
+if is_sqlite:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
+# expire_on_commit=False: объекты остаются читаемыми после commit без повторного запроса,
+# что обязательно для асинхронной сессии (там ленивая подгрузка недоступна)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+async_engine = None
+AsyncSessionLocal = None
+if settings.DATABASE_ASYNC:
+    # Импортируем лениво: модулю asyncio из SQLAlchemy нужен greenlet
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(_async_url(settings.DATABASE_URL), **_engine_kwargs())
+    if is_sqlite:
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Режим DATABASE_ASYNC=False: свой пул потоков и места по числу соединений пула.
+# Сессия занимает место на время транзакции (как соединение), а ждет его в event loop,
+# поэтому потоки не уходят целиком на ожидание соединения или чужой блокировки
+# SQLite, и держателю блокировки всегда есть на чем выполнить следующий запрос.
+_SYNC_CAPACITY = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+_sync_executor = ThreadPoolExecutor(max_workers=_SYNC_CAPACITY, thread_name_prefix="db")
+_sync_slots = asyncio.Semaphore(_SYNC_CAPACITY)
+
+
+class _ThreadedStreamResult:
+    def __init__(self, session, result):
+        self._session = session
+        self._result = result
+
+    async def partitions(self, size: int):
+        while True:
+            rows = await self._session._call(self._result.fetchmany, size)
+            if not rows:
+                return
+            yield rows
+
+
+def _buffered(result):
+    """
+    Result, который можно читать вне потока БД: строки выбраны заранее.
+
+    Результат без строк (UPDATE/DELETE/INSERT без RETURNING — и Core CursorResult,
+    и ORM-результат массовой вставки, у которого нет returns_rows) freeze()
+    не поддерживает; его отдаем как есть — нужен только rowcount.
+    """
     try:
+        return result.freeze()()
+    except NotImplementedError:
+        return result
+
+
+class ThreadedSession:
+    """
+    Обертка над синхронной Session с тем же awaitable-интерфейсом, что у AsyncSession.
+
+    Используется при DATABASE_ASYNC=False: каждый запрос к БД уходит в поток,
+    поэтому event loop не блокируется, а код роутеров одинаков для обоих режимов.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+        self._has_slot = False
+
+    async def _call(self, fn, *args, **kwargs):
+        """Выполняет fn в потоке БД, сначала заняв место, если транзакция еще не начата."""
+        if not self._has_slot:
+            await _sync_slots.acquire()
+            self._has_slot = True
+        # Как и asyncio.to_thread, передаем в поток contextvars запроса (метрики)
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(_sync_executor, call)
+
+    async def _end_transaction(self, fn):
+        """commit/rollback/close: соединение возвращается в пул, место освобождается."""
+        try:
+            if self._has_slot:
+                await self._call(fn)
+            else:
+                # Без транзакции нет и соединения — ввода-вывода не будет
+                fn()
+        finally:
+            if self._has_slot:
+                self._has_slot = False
+                _sync_slots.release()
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self._call(fn, self.sync_session, *args, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        # Запрос и выборка строк идут одним вызовом в потоке, наружу отдаем буферизованный Result
+        def _run():
+            return _buffered(self.sync_session.execute(statement, *args, **kwargs))
+        return await self._call(_run)
+
+    async def stream(self, statement, *args, **kwargs):
+        """Результат с серверным курсором; строки читаются пачками в потоке, как в AsyncSession.stream."""
+        result = await self._call(
+            self.sync_session.execute, statement.execution_options(stream_results=True), *args, **kwargs
+        )
+        return _ThreadedStreamResult(self, result)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await self._call(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        result = await self.execute(statement, *args, **kwargs)
+        return result.scalars()
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._call(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await self._call(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await self._call(self.sync_session.flush)
+
+    async def commit(self):
+        await self._end_transaction(self.sync_session.commit)
+
+    async def rollback(self):
+        await self._end_transaction(self.sync_session.rollback)
+
+    async def refresh(self, instance, *args, **kwargs):
+        await self._call(self.sync_session.refresh, instance, *args, **kwargs)
+
+    async def close(self):
+        await self._end_transaction(self.sync_session.close)
+
+
+@asynccontextmanager
+async def session_scope():
+    """Открывает сессию БД в выбранном режиме (AsyncSession или ThreadedSession)."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            yield session
+    else:
+        session = ThreadedSession(SessionLocal())
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+async def get_db():
+    async with session_scope() as db:
         yield db
-    finally:
-        db.close()
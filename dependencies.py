@@ -1,22 +1,57 @@
 from fastapi import Request, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-import models
-from database import get_db
+import models, schemas
+from cache import TTLCache
+from config import settings
+from database import session_scope
+from security import decode_access_token, password_fingerprint
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+# Кэш пользователей: user_id -> (UserPrincipal, отпечаток пароля)
+_principals = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+def invalidate_user(user_id: int):
+    """Сбрасывает закэшированного пользователя (например, после смены пароля)."""
+    _principals.pop(user_id)
+
+async def _load_principal(user_id: int):
+    entry = _principals.get(user_id)
+    if entry is None:
+        async with session_scope() as db:
+            user = await db.get(models.User, user_id)
+        if not user:
+            return None
+        entry = (
+            schemas.UserPrincipal(id=user.id, username=user.username, is_admin=bool(user.is_admin)),
+            password_fingerprint(user.password_version)
+        )
+        _principals.set(user_id, entry)
+    return entry
+
+async def get_current_user(request: Request):
     """
-    Dependency to get the current user from the user_id cookie.
-    Returns the user object or None.
+    Dependency to get the current user from the signed session cookie.
+    Returns a UserPrincipal or None. Hot pages hit the DB only on a cache miss.
     """
-    user_id = request.cookies.get("user_id")
-    if user_id:
-        try:
-            return db.query(models.User).filter(models.User.id == int(user_id)).first()
-        except (ValueError, TypeError):
-            return None
-    return None
+    token = request.cookies.get(settings.SESSION_COOKIE_NAME)
+    if not token:
+        return None
+    payload = decode_access_token(token)
+    if not payload:
+        return None
+    try:
+        user_id = int(payload.get("sub"))
+    except (ValueError, TypeError):
+        return None
+
+    entry = await _load_principal(user_id)
+    if entry is None:
+        return None
+    principal, fingerprint = entry
+    # Токен выдан до смены пароля — сессия больше не действительна
+    if payload.get("pwd") != fingerprint:
+        return None
+    return principal
 
-async def get_current_admin_user(user: models.User = Depends(get_current_user)):
+async def get_current_admin_user(user: schemas.UserPrincipal = Depends(get_current_user)):
     """
     Dependency to ensure the current user is an admin.
     Raises HTTPException if the user is not an admin.
@@ -1,32 +1,111 @@
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, Request, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-import models
-from database import engine, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+import schemas
+from config import settings
+from database import engine, async_engine, get_db
 from routers import auth, poems, users, admin
 from dependencies import get_current_user
+from pagination import poem_catalogue_page, clamp_limit
+import search, migrations, page_cache, answer_cache, analyses, metrics, templating, ai_streams
+from templating import templates
+from ai_scheduler import scheduler
+from chat_writer import writer
 
-# Создаем таблицы в БД
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Poetry AI Portal")
-
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-# Подключаем модули из папки routers
-app.include_router(auth.router, prefix="/auth", tags=["Auth"])
-app.include_router(poems.router, tags=["Poems"])
-app.include_router(users.router, tags=["Users"]) # Профиль пользователя
-app.include_router(admin.router) # Панель администратора
-
-@app.get("/")
-async def index_page(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    all_poems = db.query(models.Poem).all()
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
-        "poems": all_poems, 
-        "user": current_user
-    })
-        
+
+def prepare_database():
+    """
+    Схему при старте не создаем: это отдельный шаг `python migrations.py`.
+    Воркер лишь проверяет, что миграции применены, и выбирает реализацию поиска.
+    """
+    if settings.SCHEMA_SETUP_ON_STARTUP:
+        migrations.setup_schema(engine)
+    else:
+        missing = migrations.pending(engine)
+        if missing:
+            raise RuntimeError(
+                f"Database schema is out of date (pending: {', '.join(missing)}). "
+                "Run `python migrations.py` or set SCHEMA_SETUP_ON_STARTUP=true."
+            )
+    search.activate(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prepare_database()
+    templating.warm()
+    yield
+    await analyses.close()
+    # Незавершенные ответы сохраняем как failed, пока очередь записи еще работает
+    await ai_streams.close()
+    # Дописываем в БД сообщения, которые еще ждут в очереди отложенной записи
+    await writer.close()
+
+
+async def index_page(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    async def render():
+        # Текст стихов сюда не грузим — модалка запрашивает его через /poem/{id}/content
+        poems, next_cursor = await poem_catalogue_page(db, after=after, limit=limit)
+        return templates.TemplateResponse("index.html", {
+            "request": request,
+            "poems": poems,
+            "next_cursor": next_cursor,
+            "is_first_page": after is None,
+            "user": current_user
+        })
+
+    if current_user is None:
+        # Анонимная страница одинакова для всех — отдаем из кэша до следующей правки каталога
+        return await page_cache.cached_page(request, db, ("index", after, clamp_limit(limit)), render)
+    return await render()
+
+
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def create_app() -> FastAPI:
+    """
+    Собирает приложение. Тяжелая работа (проверка схемы, прогрев шаблонов)
+    выполняется в lifespan, а не при импорте; SDK Gemini грузится при первом
+    запросе к ИИ (ai_service.sdk).
+
+    Запуск: uvicorn main:create_app --factory (или uvicorn main:app).
+    """
+    app = FastAPI(title="Poetry AI Portal", lifespan=lifespan)
+
+    if settings.METRICS_ENABLED:
+        # Считаем SQL обоих движков: синхронный обслуживает режим DATABASE_ASYNC=False
+        metrics.instrument_engine(engine)
+        if async_engine is not None:
+            metrics.instrument_engine(async_engine.sync_engine)
+        metrics.register_stats("ai_scheduler", scheduler.stats)
+        metrics.register_stats("answer_cache", answer_cache.stats)
+        metrics.register_stats("chat_writer", writer.stats)
+        metrics.register_stats("page_cache", page_cache.stats)
+        metrics.register_stats("analyses", analyses.stats)
+        app.add_middleware(metrics.MetricsMiddleware)
+        app.get("/metrics", include_in_schema=False)(metrics_endpoint)
+
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    # Подключаем модули из папки routers
+    app.include_router(auth.router, prefix="/auth", tags=["Auth"])
+    app.include_router(poems.router, tags=["Poems"])
+    app.include_router(users.router, tags=["Users"]) # Профиль пользователя
+    app.include_router(admin.router) # Панель администратора
+    app.get("/")(index_page)
+    return app
+
+
+app = create_app()
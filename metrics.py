@@ -0,0 +1,242 @@
+"""
+Метрики горячих путей в формате Prometheus (GET /metrics).
+
+Что меряем:
+- длительность запроса по шаблону маршрута (до последнего байта ответа, для стримов — весь стрим);
+- число и длительность SQL-запросов на запрос — через события движков SQLAlchemy;
+- время рендера шаблонов, bcrypt и ответа Gemini (время до первого блока,
+  блоков в секунду, длительность стрима).
+
+Текущий запрос отслеживается через contextvar: задачи и потоки, запущенные из
+обработчика (стрим ответа, to_thread), пишут в тот же RequestTrace. Если
+задан METRICS_SLOW_REQUEST_MS, медленные запросы печатаются с разбивкой по
+этапам и списком SQL.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# Сколько SQL помним на запрос для лога медленных запросов
+MAX_TRACED_QUERIES = 100
+MAX_LOGGED_SQL_CHARS = 300
+
+_registry = []
+_stats_sources = {}
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как prometheus_client, но без зависимости)."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        # label values -> [счетчики корзин..., +Inf, сумма]
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                bucket_labels = _labels(self.label_names + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(series[-1], 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("poetry_http_request_duration_seconds", "Request duration by route", ("method", "route"))
+REQUESTS = Counter("poetry_http_requests_total", "Requests by route and status", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("poetry_db_queries_per_request", "SQL statements per request", ("route",), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("poetry_db_seconds_per_request", "Time in SQL per request", ("route",))
+QUERY_SECONDS = Histogram("poetry_db_query_duration_seconds", "SQL statement duration")
+TEMPLATE_SECONDS = Histogram("poetry_template_render_seconds", "Template render time", ("template",))
+PASSWORD_HASH_SECONDS = Histogram("poetry_password_hash_seconds", "bcrypt hash/verify time including queueing")
+AI_FIRST_CHUNK_SECONDS = Histogram("poetry_ai_time_to_first_chunk_seconds", "Gemini time to first streamed chunk")
+AI_STREAM_SECONDS = Histogram("poetry_ai_stream_duration_seconds", "Gemini stream duration")
+AI_CHUNKS_PER_SECOND = Histogram("poetry_ai_stream_chunks_per_second", "Gemini chunks per second after the first", buckets=RATE_BUCKETS)
+AI_STREAMS = Counter("poetry_ai_streams_total", "Gemini streams by outcome", ("outcome",))
+
+
+class RequestTrace:
+    """Что успел сделать один запрос: SQL и время по этапам."""
+
+    def __init__(self, method: str, path: str):
+        self.method, self.path = method, path
+        self.started = time.perf_counter()
+        self.finished = False
+        self.query_count = 0
+        self.stages = {"db": 0.0}
+        self.queries = []
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    trace = _trace.get()
+    # Фоновые задачи (например, writer) наследуют контекст запроса, который уже закончился
+    return trace if trace is not None and not trace.finished else None
+
+
+def record(stage: str, seconds: float):
+    """Добавляет время этапа в текущий запрос, если он есть."""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    QUERY_SECONDS.observe(elapsed)
+    trace = current_trace()
+    if trace is not None:
+        trace.query_count += 1
+        trace.add("db", elapsed)
+        if settings.METRICS_SLOW_REQUEST_MS and len(trace.queries) < MAX_TRACED_QUERIES:
+            trace.queries.append((elapsed, statement))
+
+
+def instrument_engine(engine):
+    # create_app() может вызываться несколько раз в одном процессе
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def instrument_templates(templates):
+    """Оборачивает TemplateResponse: Starlette рендерит шаблон прямо в конструкторе ответа."""
+    template_response = templates.TemplateResponse
+
+    def timed(name, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return template_response(name, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            TEMPLATE_SECONDS.observe(elapsed, name)
+            record("template", elapsed)
+
+    templates.TemplateResponse = timed
+    return templates
+
+
+def register_stats(name: str, source):
+    """Отдает числовые поля словаря source() на /metrics как gauge poetry_<name>_<поле>."""
+    _stats_sources[name] = source
+
+
+def _flatten(prefix: str, values: dict):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from _flatten(f"{prefix}_{key}", value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}_{key}", value
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, source in _stats_sources.items():
+        for metric_name, value in _flatten(f"poetry_{name}", source()):
+            lines.append(f"# TYPE {metric_name} gauge")
+            lines.append(f"{metric_name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _log_slow(trace: RequestTrace, status: int, elapsed: float):
+    stages = ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in trace.stages.items())
+    print(f"Slow request {trace.method} {trace.path} -> {status} in {elapsed * 1000:.1f}ms "
+          f"({trace.query_count} queries; {stages})")
+    for seconds, statement in trace.queries:
+        print(f"  {seconds * 1000:8.2f}ms  {' '.join(statement.split())[:MAX_LOGGED_SQL_CHARS]}")
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время запроса считается до последнего куска тела, поэтому
+    стримы (SSE, экспорт) учитываются целиком, а не до отправки заголовков.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _trace.set(trace)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _trace.reset(token)
+            trace.finished = True
+            elapsed = time.perf_counter() - trace.started
+            # Шаблон пути, а не сам путь: /poem/{poem_id} — одна серия на все стихи
+            route = getattr(scope.get("route"), "path", "other")
+            REQUEST_SECONDS.observe(elapsed, trace.method, route)
+            REQUESTS.inc(trace.method, route, status)
+            REQUEST_QUERIES.observe(trace.query_count, route)
+            REQUEST_DB_SECONDS.observe(trace.stages["db"], route)
+            if settings.METRICS_SLOW_REQUEST_MS and elapsed * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+                _log_slow(trace, status, elapsed)
@@ -0,0 +1,164 @@
+"""
+Легковесные миграции схемы поверх create_all.
+
+create_all создает только отсутствующие таблицы и не трогает существующие,
+поэтому новые индексы и колонки для уже развернутых баз добавляются здесь.
+Каждый шаг — функция от соединения с номером версии; примененные версии
+записываются в таблицу schema_migrations, и при следующем запуске шаг
+пропускается. Шаги пишутся идемпотентно (IF NOT EXISTS), потому что на
+свежей базе create_all уже мог создать то же самое из models.
+
+Приложение при старте схему не меняет (см. SCHEMA_SETUP_ON_STARTUP), поэтому
+перед первым запуском и после обновления кода выполняется отдельный шаг:
+    python migrations.py
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+
+def _chat_indexes(connection):
+    """Составные индексы горячих запросов к чатам (см. queries.py)."""
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_created "
+        "ON chat_messages (session_id, created_at)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_poem_created "
+        "ON chat_sessions (user_id, poem_id, created_at)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_created "
+        "ON chat_sessions (user_id, created_at)"
+    )
+
+
+def _session_stats(connection):
+    """Сводка сессии для боковой панели: число сообщений, время и превью последнего."""
+    columns = {column["name"] for column in inspect(connection).get_columns("chat_sessions")}
+    if "message_count" not in columns:
+        connection.exec_driver_sql("ALTER TABLE chat_sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+    if "last_message_at" not in columns:
+        connection.exec_driver_sql("ALTER TABLE chat_sessions ADD COLUMN last_message_at TIMESTAMP")
+    if "last_message_preview" not in columns:
+        connection.exec_driver_sql("ALTER TABLE chat_sessions ADD COLUMN last_message_preview VARCHAR")
+    # Заполняем по уже накопленной истории; дальше сводку поддерживает запись сообщений
+    connection.exec_driver_sql(
+        "UPDATE chat_sessions SET "
+        "message_count = (SELECT count(*) FROM chat_messages m WHERE m.session_id = chat_sessions.id), "
+        "last_message_at = (SELECT max(m.created_at) FROM chat_messages m WHERE m.session_id = chat_sessions.id), "
+        "last_message_preview = (SELECT substr(m.content, 1, 120) FROM chat_messages m "
+        "WHERE m.session_id = chat_sessions.id AND m.content <> '' ORDER BY m.created_at DESC, m.id DESC LIMIT 1)"
+    )
+    # Курсор боковой панели — (created_at, id), поэтому id нужен в индексе для сортировки
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_chat_sessions_user_created")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_created_id "
+        "ON chat_sessions (user_id, created_at, id)"
+    )
+
+
+def _catalogue_state(connection):
+    """Единственная строка с версией каталога; таблицу создает create_all."""
+    connection.exec_driver_sql(
+        "INSERT INTO catalogue_state (id, version) "
+        "SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM catalogue_state WHERE id = 1)"
+    )
+
+
+def _poem_analyses(connection):
+    """Таблица заранее сгенерированных разборов стихов."""
+    import models
+
+    models.PoemAnalysis.__table__.create(connection, checkfirst=True)
+
+
+def _chat_archives(connection):
+    """Сжатый архив сообщений давно неактивных сессий."""
+    import models
+
+    columns = {column["name"] for column in inspect(connection).get_columns("chat_sessions")}
+    if "archived_at" not in columns:
+        connection.exec_driver_sql("ALTER TABLE chat_sessions ADD COLUMN archived_at TIMESTAMP")
+    models.ChatArchive.__table__.create(connection, checkfirst=True)
+
+
+def _password_version(connection):
+    """Версия пароля для сессионных cookie вместо отпечатка хэша."""
+    columns = {column["name"] for column in inspect(connection).get_columns("users")}
+    if "password_version" not in columns:
+        connection.exec_driver_sql("ALTER TABLE users ADD COLUMN password_version INTEGER NOT NULL DEFAULT 0")
+
+
+# (версия, имя, шаг); версии только растут, примененные шаги не меняются
+MIGRATIONS = [
+    (1, "chat_indexes", _chat_indexes),
+    (2, "session_stats", _session_stats),
+    (3, "catalogue_state", _catalogue_state),
+    (4, "poem_analyses", _poem_analyses),
+    (5, "chat_archives", _chat_archives),
+    (6, "password_version", _password_version),
+]
+
+
+def _ensure_table(connection):
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    )
+
+
+def applied_versions(engine) -> set:
+    with engine.begin() as connection:
+        _ensure_table(connection)
+        return {row[0] for row in connection.exec_driver_sql("SELECT version FROM schema_migrations")}
+
+
+def upgrade(engine) -> list:
+    """Применяет недостающие миграции по порядку; возвращает имена примененных."""
+    applied = applied_versions(engine)
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            # Шаг и отметка о нем — в одной транзакции
+            with engine.begin() as connection:
+                step(connection)
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                    {"version": version, "name": name, "applied_at": datetime.utcnow()}
+                )
+        except IntegrityError:
+            # Ту же версию одновременно применил другой воркер
+            continue
+        done.append(name)
+    return done
+
+
+def pending(engine) -> list:
+    """Имена миграций, которые еще не применены к базе (только чтение, без CREATE TABLE)."""
+    if not inspect(engine).has_table("schema_migrations"):
+        return [name for version, name, step in MIGRATIONS]
+    with engine.connect() as connection:
+        applied = {row[0] for row in connection.exec_driver_sql("SELECT version FROM schema_migrations")}
+    return [name for version, name, step in MIGRATIONS if version not in applied]
+
+
+def setup_schema(engine) -> list:
+    """Полная подготовка базы: таблицы, миграции и поисковый индекс. Возвращает примененные миграции."""
+    import models, search
+
+    models.Base.metadata.create_all(bind=engine)
+    applied = upgrade(engine)
+    search.setup(engine)
+    return applied
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    applied = setup_schema(engine)
+    print(f"Applied migrations: {', '.join(applied)}" if applied else "Schema is up to date")
@@ -1,15 +1,22 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
+import hashlib
 import uuid
 
+def content_hash(text: str) -> str:
+    """Стабильный хэш текста стихотворения (для ETag, кэшей и версионирования)."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=True)
     hashed_password = Column(String, nullable=False)
+    # Растет при каждой смене пароля; по нему отзываются выданные раньше сессии
+    password_version = Column(Integer, nullable=False, default=0, server_default="0")
     is_admin = Column(Boolean, default=False)
     sessions = relationship("ChatSession", back_populates="user")
 
@@ -20,6 +27,11 @@ class Poem(Base):
     author = Column(String, index=True)
     content = Column(Text)
     sessions = relationship("ChatSession", back_populates="poem")
+    analyses = relationship("PoemAnalysis", cascade="all, delete-orphan")
+
+    @property
+    def content_hash(self) -> str:
+        return content_hash(self.content)
 
 def default_uuid():
     return str(uuid.uuid4())
@@ -30,10 +42,25 @@ class ChatSession(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     poem_id = Column(Integer, ForeignKey("poems.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Денормализованная сводка для боковой панели; обновляется при записи сообщений
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String, nullable=True)
+    # Когда сообщения сессии ушли в сжатый архив (chat_archive.py); None — сообщения в chat_messages
+    archived_at = Column(DateTime, nullable=True)
     
     user = relationship("User", back_populates="sessions")
     poem = relationship("Poem", back_populates="sessions")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    summary = relationship("ChatSummary", uselist=False, cascade="all, delete-orphan")
+    archive = relationship("ChatArchive", uselist=False, cascade="all, delete-orphan")
+
+    # Последняя сессия по стихотворению и список сессий пользователя (см. queries.py).
+    # В уже существующие базы индексы добавляет migrations.py
+    __table_args__ = (
+        Index("ix_chat_sessions_user_poem_created", "user_id", "poem_id", "created_at"),
+        Index("ix_chat_sessions_user_created_id", "user_id", "created_at", "id"),
+    )
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -45,4 +72,57 @@ class ChatMessage(Base):
 
     session = relationship("ChatSession", back_populates="messages")
 
-    
+    # Сообщения сессии по порядку; в SQLite id (rowid) входит в индекс неявно и добивает сортировку
+    __table_args__ = (
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+    )
+
+class ChatSummary(Base):
+    """Сжатое содержание старой части беседы, которое обновляется инкрементально."""
+    __tablename__ = "chat_summaries"
+    session_id = Column(String, ForeignKey("chat_sessions.id"), primary_key=True)
+    content = Column(Text, nullable=False, default="")
+    # id последнего сообщения, уже учтенного в summary
+    summarized_until_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChatArchive(Base):
+    """Сообщения давно неактивной сессии одним сжатым блоком (zlib от JSON)."""
+    __tablename__ = "chat_archives"
+    session_id = Column(String, ForeignKey("chat_sessions.id"), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # Размер несжатого JSON — для оценки выигрыша от архивации
+    raw_bytes = Column(Integer, nullable=False)
+
+class ChatStream(Base):
+    """Генерация ответа модели, к которой клиент может переподключиться по Last-Event-ID."""
+    __tablename__ = "chat_streams"
+    id = Column(String, primary_key=True, default=default_uuid)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False, index=True)
+    # Сообщение модели, в которое по ходу стрима пишется частичный ответ
+    message_id = Column(Integer, ForeignKey("chat_messages.id"), nullable=False)
+    status = Column(String, nullable=False, default="streaming")  # streaming | complete | failed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CatalogueState(Base):
+    """Версия каталога стихов: растет при каждой правке через админку (ключ кэша страниц)."""
+    __tablename__ = "catalogue_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class PoemAnalysis(Base):
+    """Заранее сгенерированный стандартный разбор стихотворения (см. analyses.py)."""
+    __tablename__ = "poem_analyses"
+    id = Column(Integer, primary_key=True)
+    poem_id = Column(Integer, ForeignKey("poems.id"), nullable=False)
+    kind = Column(String, nullable=False)  # summary | themes | meter | imagery
+    # Хэш текста, по которому сгенерирован разбор: после правки стиха разбор устаревает
+    content_hash = Column(String(64), nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_poem_analyses_poem_kind_hash", "poem_id", "kind", "content_hash", unique=True),
+    )
@@ -0,0 +1,83 @@
+import hashlib
+import time
+from fastapi.responses import Response
+from sqlalchemy import select, update
+from cache import TTLCache
+from config import settings
+import models
+
+# Отрендеренные страницы для анонимов: (маршрут, параметры..., версия каталога) -> (body, etag)
+_pages = TTLCache(maxsize=settings.PAGE_CACHE_SIZE, ttl=settings.PAGE_CACHE_TTL)
+_version = None
+_version_checked = 0.0
+
+
+async def catalogue_version(db) -> int:
+    """Текущая версия каталога; из БД перечитывается не чаще PAGE_CACHE_VERSION_CHECK_INTERVAL."""
+    global _version, _version_checked
+    now = time.monotonic()
+    if _version is None or now - _version_checked >= settings.PAGE_CACHE_VERSION_CHECK_INTERVAL:
+        _version = await db.scalar(
+            select(models.CatalogueState.version).where(models.CatalogueState.id == 1)
+        ) or 0
+        _version_checked = now
+    return _version
+
+
+async def bump_version(db):
+    """Увеличивает версию каталога; вызывается в той же транзакции, что и правка стихов."""
+    await db.execute(
+        update(models.CatalogueState)
+        .where(models.CatalogueState.id == 1)
+        .values(version=models.CatalogueState.version + 1)
+    )
+
+
+def invalidate():
+    """После commit правки: этот воркер сразу перечитает версию и не отдаст старые страницы."""
+    global _version
+    _version = None
+    _pages.clear()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Для If-None-Match сравнение слабое: W/"x" совпадает с "x"
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+async def cached_page(request, db, key: tuple, render):
+    """
+    Страница для анонимного посетителя из кэша или свежим рендером.
+
+    render — корутина без аргументов, возвращающая TemplateResponse; кэшируются
+    только ответы 200. ETag — хэш тела, поэтому он одинаков во всех воркерах и
+    годится для CDN; Vary: Cookie не дает отдать эту страницу вошедшему пользователю.
+    """
+    version = await catalogue_version(db)
+    entry = _pages.get((*key, version))
+    if entry is None:
+        response = await render()
+        if response.status_code != 200:
+            return response
+        body = bytes(response.body)
+        entry = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        _pages.set((*key, version), entry)
+
+    body, etag = entry
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.PAGE_CACHE_MAX_AGE}, must-revalidate",
+        "Vary": "Cookie",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+def stats() -> dict:
+    return {"size": len(_pages), "hits": _pages.hits, "misses": _pages.misses, "version": _version}
@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+import models, queries
+
+# Размер страницы каталога по умолчанию и верхняя граница для ?limit=
+PAGE_SIZE = 48
+MAX_PAGE_SIZE = 200
+# Страница списка обсуждений в боковой панели
+SESSION_PAGE_SIZE = 30
+
+
+def clamp_limit(limit: Optional[int], default: int = PAGE_SIZE) -> int:
+    """Приводит запрошенный размер страницы к допустимому диапазону."""
+    if not limit or limit < 1:
+        return default
+    return min(limit, MAX_PAGE_SIZE)
+
+
+async def keyset_page(db, stmt, key_column, after: Optional[int] = None, limit: Optional[int] = None):
+    """
+    Keyset (cursor) пагинация по монотонному ключу.
+
+    Вместо OFFSET берём строки с ключом больше курсора, поэтому стоимость
+    запроса не зависит от номера страницы. Возвращает (rows, next_cursor),
+    где next_cursor равен None на последней странице.
+    """
+    limit = clamp_limit(limit)
+    if after is not None:
+        stmt = stmt.where(key_column > after)
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    rows = (await db.execute(stmt.order_by(key_column.asc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], key_column.key)
+    return rows, None
+
+
+async def poem_catalogue_page(db, after: Optional[int] = None, limit: Optional[int] = None):
+    """Страница каталога: только id/title/author, без тяжёлого content."""
+    stmt = select(models.Poem.id, models.Poem.title, models.Poem.author)
+    return await keyset_page(db, stmt, models.Poem.id, after=after, limit=limit)
+
+
+def encode_session_cursor(row) -> str:
+    return f"{row.created_at.isoformat()}|{row.id}"
+
+
+def decode_session_cursor(cursor: str):
+    """Курсор боковой панели -> (created_at, id); ValueError, если он испорчен."""
+    created_at, _, session_id = cursor.partition("|")
+    if not session_id:
+        raise ValueError("bad cursor")
+    return datetime.fromisoformat(created_at), session_id
+
+
+async def session_sidebar_page(db, user_id: int, cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    Страница обсуждений пользователя для боковой панели: (rows, next_cursor).
+
+    Ключ сессий (created_at, id) не монотонный числовой, поэтому курсор
+    составной; сортировку и фильтр по нему покрывает ix_chat_sessions_user_created_id.
+    """
+    limit = clamp_limit(limit, SESSION_PAGE_SIZE)
+    before = decode_session_cursor(cursor) if cursor else None
+    rows = (await db.execute(queries.sidebar_sessions(user_id, before).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_session_cursor(rows[-1])
+    return rows, None
@@ -0,0 +1,283 @@
+"""
+Потоковый импорт и экспорт стихов (NDJSON и CSV) для админки.
+
+Загрузка разбирается по кускам, записи проверяются, дубликаты по
+(название, автор, хэш текста) отбрасываются, а вставка идет пачками —
+по транзакции на пачку. Экспорт читает таблицу серверным курсором. Ни в
+одну сторону весь корпус в памяти не держится: при импорте помним только
+хэши уже увиденных стихов.
+"""
+import codecs
+import csv
+import io
+import json
+import tempfile
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, insert
+from database import session_scope
+import models, page_cache
+
+FORMATS = ("ndjson", "csv")
+FIELDS = ("title", "author", "content")
+# Размер куска чтения загрузки, пачки вставки и пачки курсора экспорта
+READ_CHUNK = 64 * 1024
+BATCH_SIZE = 500
+SPOOL_MEMORY_BYTES = 1024 * 1024
+# Ограничения на одну запись; запись длиннее MAX_RECORD_CHARS прерывает импорт
+MAX_TITLE_CHARS = 300
+MAX_CONTENT_CHARS = 100_000
+MAX_RECORD_CHARS = 1_000_000
+# Сколько ошибок по строкам возвращать в отчете
+MAX_REPORTED_ERRORS = 50
+
+# Тексты стихов бывают длиннее стандартного лимита поля csv (128 КБ)
+csv.field_size_limit(MAX_RECORD_CHARS)
+
+
+class ImportAborted(Exception):
+    """Загрузку дальше разбирать нельзя (например, строка без конца)."""
+
+
+async def spool_upload(upload) -> UploadFile:
+    """
+    Копия загрузки, которая переживет обработчик запроса.
+
+    FastAPI закрывает UploadFile сразу после возврата из обработчика, а импорт
+    идет дольше — в потоковом ответе. Копируем кусками во временный файл
+    (в памяти только первый мегабайт), так что разбор остается потоковым.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    while True:
+        chunk = await upload.read(READ_CHUNK)
+        if not chunk:
+            break
+        await run_in_threadpool(spool.write, chunk)
+    spool.seek(0)
+    return UploadFile(spool, filename=upload.filename)
+
+
+def detect_format(filename: str, requested: str = None) -> str:
+    if requested in FORMATS:
+        return requested
+    return "csv" if (filename or "").lower().endswith(".csv") else "ndjson"
+
+
+def poem_key(title: str, author: str, content: str) -> str:
+    """Ключ дедупликации: название и автор как есть, текст — хэшем."""
+    return models.content_hash("\x1f".join([title, author, models.content_hash(content)]))
+
+
+async def _lines(upload):
+    """Строки загрузки (с переводом строки) по мере чтения; BOM и CRLF допускаются."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = await upload.read(READ_CHUNK)
+        pending += decoder.decode(chunk, final=not chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line + "\n"
+        if len(pending) > MAX_RECORD_CHARS:
+            raise ImportAborted(f"Запись длиннее {MAX_RECORD_CHARS} символов")
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+async def _ndjson_records(upload):
+    line_no = 0
+    async for line in _lines(upload):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"некорректный JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "ожидается JSON-объект"
+            continue
+        yield line_no, record, None
+
+
+def _inside_quotes(line: str, in_quotes: bool) -> bool:
+    """
+    Осталась ли запись внутри поля в кавычках после строки line — по правилам csv.reader:
+    кавычка открывает поле только в его начале, в середине поля это обычный символ.
+    """
+    position = 0
+    while True:
+        quote = line.find('"', position)
+        if quote < 0:
+            return in_quotes
+        if in_quotes:
+            if line.startswith('"', quote + 1):
+                # Удвоенная кавычка внутри поля
+                position = quote + 2
+                continue
+            in_quotes = False
+        elif quote == 0 or line[quote - 1] == ",":
+            in_quotes = True
+        position = quote + 1
+
+
+async def _csv_records(upload):
+    """
+    Записи CSV с заголовком. Поле в кавычках может занимать несколько строк,
+    поэтому строки копятся, пока запись не выйдет из поля в кавычках. Если
+    csv.reader все же вернет из накопленного текста несколько записей,
+    отдаем каждую со своим номером строки.
+    """
+    header = None
+    pending = ""
+    in_quotes = False
+    line_no = start_line = 0
+    async for line in _lines(upload):
+        line_no += 1
+        if not pending:
+            start_line = line_no
+        pending += line
+        in_quotes = _inside_quotes(line, in_quotes)
+        if in_quotes:
+            if len(pending) > MAX_RECORD_CHARS:
+                raise ImportAborted(f"Незакрытая кавычка в записи со строки {start_line}")
+            continue
+        text, pending = pending, ""
+        reader = csv.reader(io.StringIO(text))
+        rows = []
+        error = None
+        consumed = 0
+        try:
+            for row in reader:
+                rows.append((start_line + consumed, row))
+                consumed = reader.line_num
+        except csv.Error as e:
+            error = (start_line + consumed, f"некорректная строка CSV: {e}")
+        for row_line, row in rows:
+            if header is None:
+                header = [name.strip().lower() for name in row]
+                missing = [field for field in FIELDS if field not in header]
+                if missing:
+                    raise ImportAborted(f"В заголовке CSV нет колонок: {', '.join(missing)}")
+                continue
+            yield row_line, dict(zip(header, row)), None
+        if error is not None:
+            yield error[0], None, error[1]
+    if pending.strip():
+        yield start_line, None, "незакрытая кавычка в конце файла"
+
+
+def validate(record: dict):
+    """Поля стихотворения из записи или текст ошибки."""
+    values = {}
+    for field in FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, f"нет поля {field}"
+        values[field] = value.strip() if field != "content" else value.strip("\r\n")
+    if len(values["title"]) > MAX_TITLE_CHARS or len(values["author"]) > MAX_TITLE_CHARS:
+        return None, f"название или автор длиннее {MAX_TITLE_CHARS} символов"
+    if len(values["content"]) > MAX_CONTENT_CHARS:
+        return None, f"текст длиннее {MAX_CONTENT_CHARS} символов"
+    return values, None
+
+
+async def _existing_keys(db, batch: list) -> set:
+    """Ключи стихов пачки, которые уже есть в БД (ищем по названиям, сверяем хэш)."""
+    titles = {poem["title"] for poem in batch}
+    rows = await db.execute(
+        select(models.Poem.title, models.Poem.author, models.Poem.content).where(models.Poem.title.in_(titles))
+    )
+    return {poem_key(row.title or "", row.author or "", row.content or "") for row in rows}
+
+
+async def _insert_batch(batch: list, keys: list) -> int:
+    async with session_scope() as db:
+        existing = await _existing_keys(db, batch)
+        fresh = [poem for poem, key in zip(batch, keys) if key not in existing]
+        if fresh:
+            await db.execute(insert(models.Poem), fresh)
+            await page_cache.bump_version(db)
+            await db.commit()
+    return len(fresh)
+
+
+async def import_poems(upload, fmt: str):
+    """
+    Импортирует стихи из загрузки; отдает отчеты о ходе импорта после каждой пачки
+    и итоговый отчет со списком ошибок (поле done=True).
+    """
+    progress = {"processed": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    errors = []
+    seen = set()
+    batch, keys = [], []
+
+    async def flush():
+        inserted = await _insert_batch(batch, keys)
+        progress["inserted"] += inserted
+        progress["duplicates"] += len(batch) - inserted
+        batch.clear()
+        keys.clear()
+
+    records = _csv_records(upload) if fmt == "csv" else _ndjson_records(upload)
+    try:
+        async for line_no, record, error in records:
+            progress["processed"] += 1
+            poem = None
+            if error is None:
+                poem, error = validate(record)
+            if error is not None:
+                progress["invalid"] += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": line_no, "error": error})
+                continue
+
+            key = poem_key(poem["title"], poem["author"], poem["content"])
+            if key in seen:
+                progress["duplicates"] += 1
+                continue
+            seen.add(key)
+            batch.append(poem)
+            keys.append(key)
+            if len(batch) >= BATCH_SIZE:
+                await flush()
+                yield dict(progress)
+        if batch:
+            await flush()
+    except ImportAborted as e:
+        if batch:
+            await flush()
+        errors.append({"line": None, "error": str(e)})
+    finally:
+        if progress["inserted"]:
+            page_cache.invalidate()
+
+    yield {**progress, "done": True, "errors": errors}
+
+
+async def export_poems(fmt: str):
+    """Все стихи по порядку id кусками текста NDJSON или CSV."""
+    stmt = select(models.Poem.id, models.Poem.title, models.Poem.author, models.Poem.content).order_by(models.Poem.id)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["id", *FIELDS])
+        yield buffer.getvalue()
+
+    async with session_scope() as db:
+        result = await db.stream(stmt.execution_options(yield_per=BATCH_SIZE))
+        async for rows in result.partitions(BATCH_SIZE):
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows([(row.id, row.title, row.author, row.content) for row in rows])
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps({"id": row.id, "title": row.title, "author": row.author, "content": row.content},
+                               ensure_ascii=False) + "\n"
+                    for row in rows
+                )
@@ -0,0 +1,80 @@
+"""
+Запросы горячего пути к чатам.
+
+Собраны в одном месте, чтобы роутеры и проверка планов
+(python -m benchmarks.query_plans) выполняли одни и те же выражения:
+фильтр и сортировка каждого совпадают с колонками составного индекса из models.
+"""
+import re
+from datetime import datetime
+from sqlalchemy import select, update, or_, and_
+import models
+
+# Сколько символов последнего сообщения хранится для боковой панели
+PREVIEW_CHARS = 120
+
+
+def latest_session(user_id: int, poem_id: int):
+    """Последняя сессия пользователя по стихотворению (ix_chat_sessions_user_poem_created)."""
+    return select(models.ChatSession).where(
+        models.ChatSession.user_id == user_id,
+        models.ChatSession.poem_id == poem_id
+    ).order_by(models.ChatSession.created_at.desc()).limit(1)
+
+
+def sidebar_sessions(user_id: int, before=None):
+    """
+    Строки боковой панели, новые сначала (ix_chat_sessions_user_created_id).
+
+    Только сводка сессии и название стиха: ни сообщения, ни Poem.content не читаются.
+    before — курсор (created_at, id) последней строки предыдущей страницы.
+    """
+    stmt = select(
+        models.ChatSession.id,
+        models.ChatSession.poem_id,
+        models.ChatSession.created_at,
+        models.ChatSession.message_count,
+        models.ChatSession.last_message_at,
+        models.ChatSession.last_message_preview,
+        models.Poem.title.label("poem_title")
+    ).join(models.Poem, models.Poem.id == models.ChatSession.poem_id).where(
+        models.ChatSession.user_id == user_id
+    )
+    if before is not None:
+        created_at, session_id = before
+        stmt = stmt.where(or_(
+            models.ChatSession.created_at < created_at,
+            and_(models.ChatSession.created_at == created_at, models.ChatSession.id < session_id)
+        ))
+    return stmt.order_by(models.ChatSession.created_at.desc(), models.ChatSession.id.desc())
+
+
+def session_messages(session_id: str, after_id: int = 0):
+    """Сообщения сессии по порядку, начиная после after_id (ix_chat_messages_session_created)."""
+    stmt = select(models.ChatMessage).where(models.ChatMessage.session_id == session_id)
+    if after_id:
+        stmt = stmt.where(models.ChatMessage.id > after_id)
+    return stmt.order_by(models.ChatMessage.created_at.asc(), models.ChatMessage.id.asc())
+
+
+def owned_session_messages(session_id: str, user_id: int):
+    """Сообщения сессии, только если она принадлежит пользователю."""
+    return select(models.ChatMessage).join(models.ChatSession).where(
+        models.ChatMessage.session_id == session_id,
+        models.ChatSession.user_id == user_id
+    ).order_by(models.ChatMessage.created_at.asc(), models.ChatMessage.id.asc())
+
+
+def preview_text(content: str) -> str:
+    """Однострочное превью сообщения для боковой панели."""
+    text = re.sub(r"\s+", " ", content or "").strip()
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS - 1] + "…"
+
+
+def record_messages(session_id: str, added: int, last_content: str):
+    """Обновляет сводку сессии при записи сообщений: счетчик, время и превью последнего."""
+    return update(models.ChatSession).where(models.ChatSession.id == session_id).values(
+        message_count=models.ChatSession.message_count + added,
+        last_message_at=datetime.utcnow(),
+        last_message_preview=preview_text(last_content)
+    )
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, Request, Form, status, HTTPException
-from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from typing import Optional
+import json
+from fastapi import APIRouter, Depends, Request, Form, status, HTTPException, UploadFile, File
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
 from dependencies import get_current_admin_user
+from pagination import poem_catalogue_page
+import ai_service, answer_cache, page_cache, poem_io, analyses
+from templating import templates
+from ai_scheduler import scheduler
+from chat_writer import writer
 
 router = APIRouter(
     prefix="/admin",
@@ -12,12 +18,62 @@ router = APIRouter(
     dependencies=[Depends(get_current_admin_user)] # Все роуты здесь требуют админа
 )
 
-templates = Jinja2Templates(directory="templates")
-
 @router.get("")
-async def admin_panel(request: Request, db: Session = Depends(get_db)):
-    poems = db.query(models.Poem).all()
-    return templates.TemplateResponse("admin_panel.html", {"request": request, "poems": poems})
+async def admin_panel(
+    request: Request,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    poems, next_cursor = await poem_catalogue_page(db, after=after, limit=limit)
+    return templates.TemplateResponse("admin_panel.html", {
+        "request": request,
+        "poems": poems,
+        "next_cursor": next_cursor,
+        "is_first_page": after is None
+    })
+
+@router.get("/ai-stats")
+async def ai_stats():
+    """Состояние очереди ИИ, кэшей и очереди записи чатов — для подбора лимитов и мощностей."""
+    return {
+        "scheduler": scheduler.stats(),
+        "answer_cache": answer_cache.stats(),
+        "chat_writer": writer.stats(),
+        "page_cache": page_cache.stats(),
+        "analyses": analyses.stats(),
+    }
+
+@router.post("/poems/import")
+async def import_poems(file: UploadFile = File(...), format: Optional[str] = Form(None)):
+    """
+    Массовая загрузка стихов из NDJSON или CSV (колонки title, author, content).
+
+    Ответ — NDJSON с ходом импорта после каждой пачки и итоговой строкой с done=true.
+    """
+    fmt = poem_io.detect_format(file.filename, format)
+    upload = await poem_io.spool_upload(file)
+
+    async def progress():
+        try:
+            async for report in poem_io.import_poems(upload, fmt):
+                yield json.dumps(report, ensure_ascii=False) + "\n"
+        finally:
+            await upload.close()
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+@router.get("/poems/export")
+async def export_poems(format: str = "ndjson"):
+    """Выгрузка всех стихов потоком, без загрузки корпуса в память."""
+    if format not in poem_io.FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown format")
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        poem_io.export_poems(format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="poems.{format}"'}
+    )
 
 @router.get("/poem/add")
 async def add_poem_form(request: Request):
@@ -29,16 +85,20 @@ async def add_poem(
     title: str = Form(...),
     author: str = Form(...),
     content: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     new_poem = models.Poem(title=title, author=author, content=content)
     db.add(new_poem)
-    db.commit()
+    await page_cache.bump_version(db)
+    await db.commit()
+    page_cache.invalidate()
+    # Стандартные разборы генерируются фоном, пользователи получат их уже готовыми
+    analyses.schedule(new_poem.id)
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.get("/poem/edit/{poem_id}")
-async def edit_poem_form(request: Request, poem_id: int, db: Session = Depends(get_db)):
-    poem = db.query(models.Poem).filter(models.Poem.id == poem_id).first()
+async def edit_poem_form(request: Request, poem_id: int, db: AsyncSession = Depends(get_db)):
+    poem = await db.get(models.Poem, poem_id)
     if not poem:
         raise HTTPException(status_code=404, detail="Poem not found")
     return templates.TemplateResponse("add_poem.html", {"request": request, "poem": poem, "edit_mode": True})
@@ -50,22 +110,32 @@ async def edit_poem(
     title: str = Form(...),
     author: str = Form(...),
     content: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    poem = db.query(models.Poem).filter(models.Poem.id == poem_id).first()
+    poem = await db.get(models.Poem, poem_id)
     if not poem:
         raise HTTPException(status_code=404, detail="Poem not found")
     
     poem.title = title
     poem.author = author
     poem.content = content
-    db.commit()
+    await page_cache.bump_version(db)
+    await db.commit()
+    page_cache.invalidate()
+    ai_service.invalidate_poem(poem_id)
+    answer_cache.invalidate_poem(poem_id)
+    # Пересчитываются только разборы, чей хэш текста больше не совпадает
+    analyses.schedule(poem_id)
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 @router.get("/poem/delete/{poem_id}")
-async def delete_poem(poem_id: int, db: Session = Depends(get_db)):
-    poem = db.query(models.Poem).filter(models.Poem.id == poem_id).first()
+async def delete_poem(poem_id: int, db: AsyncSession = Depends(get_db)):
+    poem = await db.get(models.Poem, poem_id)
     if poem:
-        db.delete(poem)
-        db.commit()
+        await db.delete(poem)
+        await page_cache.bump_version(db)
+        await db.commit()
+        page_cache.invalidate()
+        ai_service.invalidate_poem(poem_id)
+        answer_cache.invalidate_poem(poem_id)
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
@@ -1,26 +1,47 @@
 from fastapi import APIRouter, Depends, Form, Request, Response, status
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
-from security import hash_password, verify_password # Используем твой security.py
+from templating import templates
+from security import hash_password_async, verify_and_update_password, set_session_cookie, PasswordHasherBusy # Используем твой security.py
+from config import settings
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+def _busy_response(request: Request, template_name: str):
+    return templates.TemplateResponse(
+        template_name,
+        {"request": request, "error": "Сервер перегружен, попробуйте еще раз через несколько секунд"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "5"}
+    )
 
 @router.get("/login")
 async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 @router.post("/login")
-async def login_handler(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def login_handler(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(models.User.username == username))
+    if not user:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Неверный логин или пароль"})
+    try:
+        password_ok, new_hash = await verify_and_update_password(password, user.hashed_password)
+    except PasswordHasherBusy:
+        return _busy_response(request, "login.html")
+    if not password_ok:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Неверный логин или пароль"})
+
+    # Параметры bcrypt поменялись — сохраняем хэш, пересчитанный с новыми.
+    # Версия пароля та же, поэтому сессии на других устройствах остаются действительными
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
-    response.set_cookie(key="user_id", value=str(user.id))
+    set_session_cookie(response, user)
     return response
 
 @router.get("/register")
@@ -32,23 +53,28 @@ async def register_handler(
     request: Request, 
     username: str = Form(...), 
     password: str = Form(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Проверяем уникальность логина
-    if db.query(models.User).filter(models.User.username == username).first():
+    if await db.scalar(select(models.User.id).where(models.User.username == username)):
         return templates.TemplateResponse("register.html", {"request": request, "error": "Этот логин уже занят"})
     
     # Проверяем, есть ли уже пользователи в базе
-    is_first_user = db.query(models.User).first() is None
+    is_first_user = await db.scalar(select(models.User.id).limit(1)) is None
+
+    try:
+        hashed_password = await hash_password_async(password)
+    except PasswordHasherBusy:
+        return _busy_response(request, "register.html")
 
     # Создаем нового пользователя
     new_user = models.User(
         username=username, 
-        hashed_password=hash_password(password),
+        hashed_password=hashed_password,
         is_admin=is_first_user # Если это первый пользователь, он становится админом
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     
     # Перенаправляем на страницу входа после успешной регистрации
     return RedirectResponse(url="/auth/login?registered=true", status_code=status.HTTP_303_SEE_OTHER)
@@ -56,6 +82,6 @@ async def register_handler(
 @router.get("/logout")
 async def logout():
     response = RedirectResponse(url="/auth/login")
-    response.delete_cookie("user_id")
+    response.delete_cookie(settings.SESSION_COOKIE_NAME)
     return response
         
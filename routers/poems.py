@@ -1,127 +1,302 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session, joinedload
+from typing import Optional
+from fastapi import APIRouter, Depends, Request, HTTPException, Header
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from database import get_db
 from ai_service import analyze_poem_with_chat_stream
-import models, schemas
+from chat_history import load_context
+import answer_cache, ai_streams, page_cache, analyses, chat_archive
+from ai_scheduler import scheduler, RateLimited
+from chat_writer import writer
+import models, schemas, queries
+from templating import templates
 from dependencies import get_current_user
+from pagination import clamp_limit, session_sidebar_page
+from search import search_poems
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 @router.get("/poem/{poem_id}")
 async def poem_detail(
     request: Request,
     poem_id: int, 
-    db: Session = Depends(get_db), 
-    user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    user: schemas.UserPrincipal = Depends(get_current_user)
 ):
     new_chat_requested = request.query_params.get('new_chat') == 'true'
 
     if not user:
-        poem = db.query(models.Poem).filter(models.Poem.id == poem_id).first()
-        if not poem:
-            raise HTTPException(status_code=404, detail="Poem not found")
-        return templates.TemplateResponse("poem_detail.html", {"request": request, "poem": poem, "user": None})
+        async def render():
+            poem = await db.get(models.Poem, poem_id)
+            if not poem:
+                raise HTTPException(status_code=404, detail="Poem not found")
+            return templates.TemplateResponse("poem_detail.html", {"request": request, "poem": poem, "user": None})
 
-    poem = db.query(models.Poem).filter(models.Poem.id == poem_id).first()
+        return await page_cache.cached_page(request, db, ("poem", poem_id), render)
+
+    poem = await db.get(models.Poem, poem_id)
     if not poem:
         raise HTTPException(status_code=404, detail="Poem not found")
 
     # Ищем сессию для этого чата
     current_session = None
     if not new_chat_requested:
-        current_session = db.query(models.ChatSession).filter(
-            models.ChatSession.user_id == user.id,
-            models.ChatSession.poem_id == poem.id
-        ).order_by(models.ChatSession.created_at.desc()).first()
+        current_session = await db.scalar(queries.latest_session(user.id, poem.id))
 
     # Если сессия не найдена или запрошена новая, создаем ее
     if not current_session:
         current_session = models.ChatSession(user_id=user.id, poem_id=poem.id)
         db.add(current_session)
-        db.commit()
-        db.refresh(current_session)
+        await db.commit()
+        await db.refresh(current_session)
 
-    # Загружаем сообщения для текущей сессии
-    chat_history = db.query(models.ChatMessage).filter(
-        models.ChatMessage.session_id == current_session.id
-    ).order_by(models.ChatMessage.created_at.asc()).all()
+    # Давно неактивная сессия хранится сжатой — к продолжению беседы возвращаем ее в горячую таблицу
+    if current_session.archived_at is not None:
+        await chat_archive.restore(db, current_session.id)
 
-    # Получаем ВСЕ сессии пользователя для истории
-    all_user_sessions = db.query(models.ChatSession).options(
-        joinedload(models.ChatSession.poem)
-    ).filter(
-        models.ChatSession.user_id == user.id
-    ).order_by(models.ChatSession.created_at.desc()).all()
+    # Загружаем сообщения для текущей сессии, включая еще не записанные из очереди
+    await writer.sync(current_session.id)
+    chat_history = (await db.scalars(queries.session_messages(current_session.id))).all()
+
+    # Первая страница обсуждений для боковой панели; остальные догружаются через /chat-sessions
+    sidebar_sessions, sidebar_cursor = await session_sidebar_page(db, user.id)
+
+    # Незавершенный ответ модели (клиент ушел посреди стрима) — страница к нему переподключится
+    active_stream = await db.scalar(select(models.ChatStream).where(
+        models.ChatStream.session_id == current_session.id,
+        models.ChatStream.status == "streaming"
+    ).order_by(models.ChatStream.created_at.desc()).limit(1))
+
+    # В пустом чате предлагаем стандартные вопросы, ответы на которые уже готовы
+    suggestions = [] if chat_history else await analyses.suggestions(db, poem)
 
     return templates.TemplateResponse("poem_detail.html", {
         "request": request, 
         "poem": poem, 
         "user": user, 
         "session_id": current_session.id,
-        "all_user_sessions": all_user_sessions,
-        "current_chat_history": chat_history
+        "active_stream": active_stream,
+        "session_created_at": current_session.created_at,
+        "sidebar_sessions": sidebar_sessions,
+        "sidebar_cursor": sidebar_cursor,
+        "current_chat_history": chat_history,
+        "suggestions": suggestions
+    })
+
+@router.get("/poem/{poem_id}/content")
+async def poem_content(request: Request, poem_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Текст одного стихотворения для модалки каталога. Браузер хранит ответ, но
+    каждый раз сверяет ETag: правка или удаление стиха видны сразу, а
+    неизменный текст приходит ответом 304 без тела.
+    """
+    poem = await db.get(models.Poem, poem_id)
+    if not poem:
+        raise HTTPException(status_code=404, detail="Poem not found")
+
+    version = models.content_hash("\n".join([poem.title or "", poem.author or "", poem.content or ""]))
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(
+        content={"id": poem.id, "title": poem.title, "author": poem.author, "content": poem.content},
+        headers=headers
+    )
+
+@router.get("/search")
+async def search_page(
+    request: Request,
+    q: str = "",
+    page: int = 1,
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    poems, has_next = await search_poems(db, q, page, clamp_limit(None))
+    return templates.TemplateResponse("index.html", {
+        "request": request,
+        "poems": poems,
+        "user": user,
+        "query": q,
+        "page": max(1, page),
+        "has_next": has_next
     })
 
+@router.get("/api/search")
+async def search_api(q: str = "", page: int = 1, limit: int = 20, db: AsyncSession = Depends(get_db)):
+    """Поиск по названию, автору и тексту с ранжированием и префиксным совпадением слов."""
+    results, has_next = await search_poems(db, q, page, clamp_limit(limit))
+    return {
+        "query": q,
+        "page": max(1, page),
+        "has_next": has_next,
+        "results": [
+            {"id": row.id, "title": row.title, "author": row.author, "snippet": row.snippet}
+            for row in results
+        ]
+    }
+
 @router.post("/ai-ask")
 async def ask_ai(
     data: schemas.ChatQuestion, 
-    db: Session = Depends(get_db), 
-    user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    user: schemas.UserPrincipal = Depends(get_current_user)
 ):
     if not user:
         raise HTTPException(status_code=401, detail="Сначала войдите в систему.")
 
-    session = db.query(models.ChatSession).options(
+    session = await db.scalar(select(models.ChatSession).options(
         joinedload(models.ChatSession.poem)
-    ).filter(
+    ).where(
         models.ChatSession.id == data.session_id,
         models.ChatSession.user_id == user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
-    history = db.query(models.ChatMessage).filter(
-        models.ChatMessage.session_id == data.session_id
-    ).order_by(models.ChatMessage.created_at.asc()).all()
+    if session.archived_at is not None:
+        await chat_archive.restore(db, session.id)
+
+    # Вместо всей истории — summary старой части и окно последних реплик
+    await writer.sync(data.session_id)
+    summary, history, has_history = await load_context(db, data.session_id)
+
+    # Стрим идет уже после выхода из get_db, поэтому забираем текст заранее
+    poem_id = session.poem_id
+    poem_content = session.poem.content
 
-    db.add(models.ChatMessage(session_id=data.session_id, role="user", content=data.question))
-    db.commit()
+    # Ответ без обращения к модели — стандартный разбор, сгенерированный заранее, готовый ответ
+    # из кэша или уже идущий запрос с тем же первым вопросом — отдаем сразу, без места в планировщике
+    answer_stream = None
+    if not has_history:
+        prepared = await analyses.prepared_answer(db, poem_id, poem_content, data.question)
+        if prepared is not None:
+            answer_stream = answer_cache.replay(prepared)
+        else:
+            answer_stream = answer_cache.shared_stream(poem_id, poem_content, data.question)
 
-    def save_and_stream():
-        full_response = ""
-        answer_stream = analyze_poem_with_chat_stream(session.poem.content, data.question, history)
-        
-        for chunk in answer_stream:
-            full_response += chunk
-            yield chunk
-        
-        db.add(models.ChatMessage(session_id=data.session_id, role="model", content=full_response))
-        db.commit()
+    on_finish = lambda: None
+    if answer_stream is None:
+        # Очередь планировщика может ждать до AI_SCHEDULER_MAX_WAIT: соединение с БД
+        # на это время возвращаем в пул, дальше обработчику БД не нужна
+        await db.close()
+        # Место в планировщике держим на все время стрима
+        try:
+            slot = await scheduler.acquire(user.id)
+        except RateLimited as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов к ИИ. Попробуйте чуть позже.",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        on_finish = slot.release
+        if not has_history:
+            # Первый вопрос сессии одинаков у многих пользователей — ответ попадет в кэш
+            answer_stream = answer_cache.first_turn_stream(poem_id, poem_content, data.question)
+        else:
+            answer_stream = analyze_poem_with_chat_stream(poem_content, data.question, history, summary, poem_id=poem_id)
 
-    return StreamingResponse(save_and_stream(), media_type="text/event-stream")
+    # Вопрос, сообщение модели и ChatStream запишутся отложенно, одной пачкой с другими чатами;
+    # частичный ответ по ходу генерации уходит туда же
+    stream_id = writer.add_turn(data.session_id, data.question)
+
+    # Генерация идет фоном и не зависит от соединения; место в планировщике освобождается по ее окончании
+    ai_streams.start_stream(stream_id, data.session_id, answer_stream, on_finish=on_finish)
+
+    return StreamingResponse(
+        ai_streams.sse_events(stream_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Stream-Id": stream_id}
+    )
+
+@router.get("/ai-ask/{stream_id}")
+async def resume_ai_stream(
+    stream_id: str,
+    last_event_id: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """Переподключение к ответу: отдает текст после позиции из Last-Event-ID без повторного вызова модели."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Сначала войдите в систему.")
+
+    # Стрим мог еще не дойти до БД из очереди записи; ждем только его сессию, а не всю очередь
+    pending_session_id = writer.session_of(stream_id)
+    if pending_session_id is not None:
+        await writer.sync(pending_session_id)
+    stream_exists = await db.scalar(select(models.ChatStream.id).join(models.ChatSession).where(
+        models.ChatStream.id == stream_id,
+        models.ChatSession.user_id == user.id
+    ))
+    if not stream_exists:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    try:
+        offset = max(0, int(last_event_id or 0))
+    except ValueError:
+        offset = 0
+
+    return StreamingResponse(
+        ai_streams.sse_events(stream_id, offset),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@router.get("/chat-sessions")
+async def chat_sessions(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    user: schemas.UserPrincipal = Depends(get_current_user)
+):
+    """Страница обсуждений пользователя для бесконечной прокрутки боковой панели."""
+    if not user:
+        raise HTTPException(status_code=401)
+
+    try:
+        rows, next_cursor = await session_sidebar_page(db, user.id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {
+        "next_cursor": next_cursor,
+        "sessions": [
+            {
+                "id": row.id,
+                "poem_id": row.poem_id,
+                "poem_title": row.poem_title,
+                "created_at": row.created_at.isoformat(),
+                "message_count": row.message_count,
+                "last_message_at": row.last_message_at.isoformat() if row.last_message_at else None,
+                "last_message_preview": row.last_message_preview,
+            }
+            for row in rows
+        ]
+    }
 
 @router.get("/chat/{session_id}")
-async def get_chat_history(session_id: str, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+async def get_chat_history(session_id: str, db: AsyncSession = Depends(get_db), user: schemas.UserPrincipal = Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401)
 
-    messages = db.query(models.ChatMessage).filter(
-        models.ChatMessage.session_id == session_id
-    ).join(models.ChatSession).filter(
-        models.ChatSession.user_id == user.id
-    ).order_by(models.ChatMessage.created_at.asc()).all()
+    await writer.sync(session_id)
+    # Просмотр старой сессии читает сжатый архив, не возвращая сообщения в горячую таблицу
+    archived = await chat_archive.archived_messages(db, session_id, user.id)
+    messages = (await db.scalars(queries.owned_session_messages(session_id, user.id))).all()
 
-    if not messages:
+    if not messages and not archived:
         # Проверяем, существует ли сессия, даже если в ней нет сообщений
-        session_exists = db.query(models.ChatSession).filter_by(id=session_id, user_id=user.id).first()
+        session_exists = await db.scalar(select(models.ChatSession.id).filter_by(id=session_id, user_id=user.id))
         if not session_exists:
             raise HTTPException(status_code=404, detail="Chat history not found")
         return JSONResponse(content=[])
 
-    return [{"role": msg.role, "content": msg.content} for msg in messages]
+    history = [{"role": msg["role"], "content": msg["content"]} for msg in archived]
+    history += [{"role": msg.role, "content": msg.content} for msg in messages]
+    return history
 
     
@@ -1,18 +1,16 @@
 from fastapi import APIRouter, Depends, Request, Form, status, HTTPException
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from security import hash_password
-import models
-from dependencies import get_current_user
+from security import hash_password_async, set_session_cookie, PasswordHasherBusy
+import models, schemas
+from templating import templates
+from dependencies import get_current_user, invalidate_user
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
 
 @router.get("/profile")
-async def profile_page(request: Request, user: models.User = Depends(get_current_user)):
+async def profile_page(request: Request, user: schemas.UserPrincipal = Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/auth/login", status_code=status.HTTP_303_SEE_OTHER)
     
@@ -23,8 +21,8 @@ async def profile_page(request: Request, user: models.User = Depends(get_current
 async def update_profile(
     request: Request,
     new_password: str = Form(None),
-    user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: schemas.UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -37,9 +35,24 @@ async def update_profile(
                 "user": user, 
                 "error": "Пароль должен быть не менее 4 символов"
             })
-        user.hashed_password = hash_password(new_password)
-        db.add(user)
-        db.commit()
+        try:
+            new_hash = await hash_password_async(new_password)
+        except PasswordHasherBusy:
+            return templates.TemplateResponse("profile.html", {
+                "request": request,
+                "user": user,
+                "error": "Сервер перегружен, попробуйте еще раз через несколько секунд"
+            }, status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "5"})
+        db_user = await db.get(models.User, user.id)
+        db_user.hashed_password = new_hash
+        db_user.password_version = (db_user.password_version or 0) + 1
+        await db.commit()
+        invalidate_user(user.id)
+
+        # Старые сессии после смены пароля недействительны — текущую перевыпускаем
+        response = RedirectResponse(url="/profile", status_code=status.HTTP_303_SEE_OTHER)
+        set_session_cookie(response, db_user)
+        return response
     
     return RedirectResponse(url="/profile", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -4,6 +4,12 @@ class UserCreate(BaseModel):
     username: str
     password: str
 
+class UserPrincipal(BaseModel):
+    """Текущий пользователь запроса — без обращения к ORM."""
+    id: int
+    username: str
+    is_admin: bool = False
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -12,4 +18,8 @@ class UserLogin(BaseModel):
 class ChatQuestion(BaseModel):
     question: str
     session_id: str
-    
+
+class ChatTurn(BaseModel):
+    """Отвязанная от БД реплика чата, которую можно безопасно передать в стрим."""
+    role: str
+    content: str
@@ -0,0 +1,180 @@
+import re
+from sqlalchemy import text
+from config import settings
+
+# Не больше стольких слов из запроса уходит в поиск
+MAX_TERMS = 8
+
+
+def query_terms(query: str) -> list:
+    """Слова запроса в нижнем регистре; пунктуация и операторы отбрасываются."""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+class SqliteFtsBackend:
+    """
+    Поиск через виртуальную таблицу FTS5 с внешним содержимым (content='poems').
+
+    Индекс поддерживают триггеры на poems, поэтому любое добавление, правка
+    или удаление стиха обновляет только его строку в индексе в той же
+    транзакции. Полная перестройка выполняется один раз — при создании таблицы.
+    """
+
+    def is_ready(self, connection) -> bool:
+        return connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'poems_fts'"
+        ).first() is not None
+
+    def setup(self, connection):
+        exists = self.is_ready(connection)
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS poems_fts USING fts5("
+            "title, author, content, content='poems', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS poems_fts_ai AFTER INSERT ON poems BEGIN "
+            "INSERT INTO poems_fts(rowid, title, author, content) VALUES (new.id, new.title, new.author, new.content); "
+            "END"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS poems_fts_ad AFTER DELETE ON poems BEGIN "
+            "INSERT INTO poems_fts(poems_fts, rowid, title, author, content) VALUES ('delete', old.id, old.title, old.author, old.content); "
+            "END"
+        )
+        connection.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS poems_fts_au AFTER UPDATE OF title, author, content ON poems BEGIN "
+            "INSERT INTO poems_fts(poems_fts, rowid, title, author, content) VALUES ('delete', old.id, old.title, old.author, old.content); "
+            "INSERT INTO poems_fts(rowid, title, author, content) VALUES (new.id, new.title, new.author, new.content); "
+            "END"
+        )
+        if not exists:
+            connection.exec_driver_sql("INSERT INTO poems_fts(poems_fts) VALUES ('rebuild')")
+
+    def statement(self, terms: list):
+        # Каждое слово — префиксный поиск; совпадение в названии весит больше, чем в авторе и тексте
+        match = " ".join(f'"{term}"*' for term in terms)
+        sql = text(
+            "SELECT p.id, p.title, p.author, "
+            "snippet(poems_fts, 2, '', '', '…', 16) AS snippet, "
+            "bm25(poems_fts, 10.0, 5.0, 1.0) AS rank "
+            "FROM poems_fts JOIN poems p ON p.id = poems_fts.rowid "
+            "WHERE poems_fts MATCH :match "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"
+        )
+        return sql, {"match": match}
+
+
+class PostgresTsvectorBackend:
+    """
+    Поиск по сохраняемой генерируемой колонке tsvector с GIN-индексом.
+
+    Postgres сам пересчитывает колонку при INSERT/UPDATE строки, так что
+    индекс обновляется инкрементально без триггеров и перестроек.
+    """
+
+    def is_ready(self, connection) -> bool:
+        return connection.exec_driver_sql(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'poems' AND column_name = 'search_vector'"
+        ).first() is not None
+
+    def setup(self, connection):
+        config = settings.SEARCH_PG_CONFIG
+        connection.exec_driver_sql(
+            "ALTER TABLE poems ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{config}', coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{config}', coalesce(author, '')), 'B') || "
+            f"setweight(to_tsvector('{config}', coalesce(content, '')), 'C')"
+            ") STORED"
+        )
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_poems_search_vector ON poems USING GIN (search_vector)"
+        )
+
+    def statement(self, terms: list):
+        config = settings.SEARCH_PG_CONFIG
+        sql = text(
+            "SELECT p.id, p.title, p.author, "
+            f"ts_headline('{config}', p.content, q, 'StartSel=\"\", StopSel=\"\", MaxWords=16, MinWords=6') AS snippet, "
+            "ts_rank_cd(p.search_vector, q) AS rank "
+            f"FROM poems p, to_tsquery('{config}', :match) q "
+            "WHERE p.search_vector @@ q "
+            "ORDER BY rank DESC, p.id LIMIT :limit OFFSET :offset"
+        )
+        return sql, {"match": " & ".join(f"{term}:*" for term in terms)}
+
+
+class LikeBackend:
+    """
+    Запасной вариант без полнотекстового индекса (другие СУБД или SQLite без FTS5).
+
+    Полный перебор таблицы; в SQLite lower() приводит к нижнему регистру только ASCII.
+    """
+
+    def is_ready(self, connection) -> bool:
+        return True
+
+    def setup(self, connection):
+        pass
+
+    def statement(self, terms: list):
+        conditions = []
+        params = {}
+        for i, term in enumerate(terms):
+            params[f"t{i}"] = f"%{term}%"
+            conditions.append(f"(lower(title) LIKE :t{i} OR lower(author) LIKE :t{i} OR lower(content) LIKE :t{i})")
+        sql = text(
+            "SELECT id, title, author, substr(content, 1, 120) AS snippet, 0 AS rank FROM poems "
+            f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT :limit OFFSET :offset"
+        )
+        return sql, params
+
+
+# Реализации по диалекту SQLAlchemy; выбирается при setup()
+BACKENDS = {
+    "sqlite": SqliteFtsBackend,
+    "postgresql": PostgresTsvectorBackend,
+}
+
+backend = LikeBackend()
+
+
+def setup(engine):
+    """Создает поисковый индекс (идемпотентно) и выбирает реализацию поиска для движка."""
+    global backend
+    candidate = BACKENDS.get(engine.dialect.name, LikeBackend)()
+    try:
+        with engine.begin() as connection:
+            candidate.setup(connection)
+        backend = candidate
+    except Exception as e:
+        print(f"Search index setup failed, falling back to LIKE: {e}")
+        backend = LikeBackend()
+
+
+def activate(engine):
+    """
+    Выбирает реализацию поиска при старте воркера, ничего не создавая в БД.
+
+    Индекс создает setup() из `python migrations.py`; пока его нет, ищем через LIKE.
+    """
+    global backend
+    candidate = BACKENDS.get(engine.dialect.name, LikeBackend)()
+    try:
+        with engine.connect() as connection:
+            ready = candidate.is_ready(connection)
+    except Exception as e:
+        print(f"Search index check failed, falling back to LIKE: {e}")
+        ready = False
+    backend = candidate if ready else LikeBackend()
+
+
+async def search_poems(db, query: str, page: int = 1, limit: int = 20):
+    """Страница результатов поиска по названию, автору и тексту: (rows, has_next)."""
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+    page = max(1, page)
+    sql, params = backend.statement(terms)
+    rows = (await db.execute(sql, {**params, "limit": limit + 1, "offset": (page - 1) * limit})).all()
+    return rows[:limit], len(rows) > limit
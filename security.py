@@ -1,9 +1,21 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import jwt
+from jose import jwt, JWTError
 from config import settings
+import metrics
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# При изменении параметров старые хэши помечаются устаревшими и пересчитываются при входе
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt отпускает GIL, поэтому пула потоков достаточно, чтобы не блокировать event loop
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
+
+class PasswordHasherBusy(Exception):
+    """Очередь хэширования переполнена или ожидание превысило PASSWORD_HASH_TIMEOUT."""
 
 def hash_password(password: str):
     # Превращаем в строку и обрезаем до 72 байт (лимит bcrypt)
@@ -14,9 +26,75 @@ def verify_password(plain_password: str, hashed_password: str):
     safe_password = str(plain_password)[:72]
     return pwd_context.verify(safe_password, hashed_password)
 
-def create_access_token(data: dict):
+def _before_deadline(deadline: float, fn, *args):
+    # Задача, которая дождалась потока уже после таймаута, не тратит CPU впустую
+    if time.monotonic() > deadline:
+        raise PasswordHasherBusy()
+    return fn(*args)
+
+async def _run_hasher(fn, *args):
+    """Выполняет bcrypt в отдельном пуле с ограниченной очередью и таймаутом."""
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        raise PasswordHasherBusy()
+    _hash_pending += 1
+    try:
+        started = time.monotonic()
+        deadline = started + settings.PASSWORD_HASH_TIMEOUT
+        future = asyncio.get_running_loop().run_in_executor(_hash_executor, _before_deadline, deadline, fn, *args)
+        return await asyncio.wait_for(future, settings.PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PasswordHasherBusy() from None
+    finally:
+        _hash_pending -= 1
+        elapsed = time.monotonic() - started
+        metrics.PASSWORD_HASH_SECONDS.observe(elapsed)
+        metrics.record("bcrypt", elapsed)
+
+async def hash_password_async(password: str):
+    return await _run_hasher(hash_password, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Проверяет пароль вне event loop. Возвращает (ok, new_hash): new_hash не None,
+    если хэш сделан со старыми параметрами CryptContext и его нужно сохранить заново.
+    """
+    safe_password = str(plain_password)[:72]
+    return await _run_hasher(pwd_context.verify_and_update, safe_password, hashed_password)
+
+def create_access_token(data: dict, expire_minutes: int = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.utcnow() + timedelta(minutes=expire_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def decode_access_token(token: str):
+    """Возвращает payload токена или None, если подпись неверна или срок истек."""
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+
+def password_fingerprint(password_version: int) -> str:
+    """
+    Отпечаток пароля в сессионной cookie: после смены пароля старые сессии перестают действовать.
+
+    Берется версия пароля, а не хэш: пересчет хэша при входе (новые параметры
+    bcrypt) не должен разлогинивать пользователя на других устройствах.
+    """
+    return str(password_version or 0)
+
+def set_session_cookie(response, user):
+    """Выдает подписанную сессионную cookie для пользователя."""
+    token = create_access_token(
+        {"sub": str(user.id), "pwd": password_fingerprint(user.password_version)},
+        expire_minutes=settings.SESSION_EXPIRE_MINUTES
+    )
+    response.set_cookie(
+        key=settings.SESSION_COOKIE_NAME,
+        value=token,
+        max_age=settings.SESSION_EXPIRE_MINUTES * 60,
+        httponly=True,
+        samesite="lax"
+    )
     
@@ -0,0 +1,34 @@
+"""
+Общее окружение Jinja2 для всех роутеров.
+
+Раньше каждый роутер создавал свой Jinja2Templates, и каждый шаблон
+компилировался отдельно в каждом из них. Теперь окружение одно, а байткод
+скомпилированных шаблонов кэшируется на диске, так что новые воркеры
+загружают готовый код вместо разбора шаблонов. warm() загружает все шаблоны
+при старте приложения, чтобы первый запрос не платил за компиляцию.
+"""
+import os
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from config import settings
+import metrics
+
+TEMPLATES_DIR = "templates"
+
+templates = metrics.instrument_templates(Jinja2Templates(directory=TEMPLATES_DIR))
+# Без автоперезагрузки Jinja не проверяет mtime файла шаблона при каждом рендере
+templates.env.auto_reload = settings.TEMPLATE_AUTO_RELOAD
+if settings.TEMPLATE_BYTECODE_CACHE_DIR:
+    os.makedirs(settings.TEMPLATE_BYTECODE_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(settings.TEMPLATE_BYTECODE_CACHE_DIR)
+else:
+    # Каталог во временной папке системы, общий для всех процессов пользователя
+    templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+
+def warm() -> int:
+    """Загружает все шаблоны в кэш окружения; возвращает их число."""
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.get_template(name)
+    return len(names)